@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+'''Generate the allowed collision matrix (ACM) of robot models. Link pairs
+that are never or always in collision over random configurations are
+stored (keyed by URDF content hash) and no longer self-collision checked
+by Manipulator.get_collisionfn. Never colliding pairs are only trusted with
+at least pb_robot.acm.MIN_NEVER_SAMPLES samples'''
+
+import argparse
+import pb_robot
+
+MODELS = ['models/franka_description/robots/panda_arm_hand.urdf',
+          'models/yumi_description/yumi.urdf',
+          'models/pr2_description/pr2.urdf',
+          'models/movo_description/movo.urdf']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('models', nargs='*', default=MODELS,
+                        help='URDF paths, relative to the pb_robot package')
+    parser.add_argument('-n', '--num_samples', type=int, default=pb_robot.acm.NUM_SAMPLES,
+                        help='Number of random configurations')
+    args = parser.parse_args()
+
+    pb_robot.utils.connect(use_gui=False)
+    for model in args.models:
+        with pb_robot.helper.HideOutput():
+            body = pb_robot.body.Body(pb_robot.utils.load_model(model, fixed_base=True))
+        acm = pb_robot.acm.compute_acm(body, num_samples=args.num_samples)
+        path = pb_robot.acm.save_acm(pb_robot.utils.get_model_path(model), acm)
+        num_pairs = sum(len(acm[c]) for c in [pb_robot.acm.NEVER, pb_robot.acm.ALWAYS, pb_robot.acm.SOMETIMES])
+        print('{}: {} never, {} always, {} sometimes of {} pairs -> {}'.format(
+            model, len(acm[pb_robot.acm.NEVER]), len(acm[pb_robot.acm.ALWAYS]),
+            len(acm[pb_robot.acm.SOMETIMES]), num_pairs, path))
+        body.remove_body()
+    pb_robot.utils.disconnect()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+'''Generate the sphere models of robots (see pb_robot.spheres). Every link
+is covered by spheres computed from its collision geometry and stored
+(keyed by URDF content hash) in $PB_ROBOT_CACHE (default ~/.cache/pb_robot),
+from where Manipulator.sphere_checks loads them. Without this, the spheres
+are recomputed in every process. Also compares the numpy forward
+kinematics the spheres are placed with to pybullet'''
+
+import argparse
+import numpy as np
+import pb_robot
+
+MODELS = ['models/franka_description/robots/panda_arm_hand.urdf',
+          'models/yumi_description/yumi.urdf',
+          'models/pr2_description/pr2.urdf',
+          'models/movo_description/movo.urdf']
+
+def max_fk_error(body, num_samples=10):
+    joints = body.get_movable_joints()
+    lower, upper = zip(*[joint.get_joint_limits() for joint in joints])
+    qs = np.random.uniform(lower, upper, size=(num_samples, len(joints)))
+    frames = pb_robot.kinematics.get_kinematic_chain(body).get_link_transforms(qs, joints)
+    old_q = body.get_joint_positions(joints)
+    error = 0.
+    for q, q_frames in zip(qs, frames):
+        body.set_joint_positions(joints, q)
+        for link in body.all_links:
+            tform = pb_robot.geometry.tform_from_pose(link.get_link_pose())
+            error = max(error, np.abs(tform - q_frames[link.linkID + 1]).max())
+    body.set_joint_positions(joints, old_q)
+    return error
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('models', nargs='*', default=MODELS,
+                        help='URDF paths, relative to the pb_robot package')
+    parser.add_argument('-n', '--num_spheres', type=int, default=pb_robot.spheres.NUM_SPHERES,
+                        help='Number of spheres per collision geometry')
+    args = parser.parse_args()
+
+    pb_robot.utils.connect(use_gui=False)
+    for model in args.models:
+        path = pb_robot.utils.get_model_path(model)
+        spheres = pb_robot.spheres.compute_spheres(path, num_spheres=args.num_spheres)
+        cache_path = pb_robot.spheres.save_spheres(path, spheres)
+        num_spheres = sum(len(link_spheres) for link_spheres in spheres['links'].values())
+        with pb_robot.helper.HideOutput():
+            body = pb_robot.body.Body(pb_robot.utils.load_model(model, fixed_base=True))
+        print('{}: {} spheres on {} links, unsupported links: {}, max FK error: {:.2e} -> {}'.format(
+            model, num_spheres, len(spheres['links']), spheres['unsupported'], max_fk_error(body), cache_path))
+        body.remove_body()
+    pb_robot.utils.disconnect()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+'''Compare the verdicts of the collision backends (pb_robot.collisions.PAIRWISE,
+which checks each link pair with getClosestPoints, and CONTACT, which runs
+performCollisionDetection and getContactPoints once per query) on the same
+random configurations. The scene contains static, awake, sleeping and
+deactivated obstacles and a grabbed object, and the comparison is repeated
+with the engine collision filters enabled.'''
+
+import sys
+import numpy
+import pybullet as p
+import pb_robot
+
+NUM_CONFIGURATIONS = 2000
+SEED = 0
+
+def createObstacles():
+    '''Boxes around the arm, in each activation state'''
+    static = pb_robot.utils.create_box(0.3, 0.3, 0.1)
+    static.set_point((0.5, 0, 0.3))
+
+    awake = pb_robot.utils.create_box(0.1, 0.1, 0.3, mass=1)
+    awake.set_point((0, 0.5, 0.3))
+
+    # Sleeping bodies are woken up by contacts
+    sleeping = pb_robot.utils.create_box(0.1, 0.1, 0.3, mass=1)
+    sleeping.set_point((0, -0.5, 0.3))
+    sleeping.set_dynamics(activationState=p.ACTIVATION_STATE_ENABLE_SLEEPING)
+    sleeping.set_dynamics(activationState=p.ACTIVATION_STATE_SLEEP)
+
+    # Deactivated bodies are never woken up
+    deactivated = pb_robot.utils.create_box(0.2, 0.2, 0.2, mass=1)
+    deactivated.set_point((-0.4, 0, 0.6))
+    deactivated.set_dynamics(activationState=p.ACTIVATION_STATE_SLEEP)
+    deactivated.set_dynamics(activationState=p.ACTIVATION_STATE_DISABLE_WAKEUP)
+    return [static, awake, sleeping, deactivated]
+
+def grabObject(arm, obj):
+    '''Grab the object at the current end effector pose'''
+    relation = numpy.dot(numpy.linalg.inv(obj.get_transform()), arm.GetEETransform())
+    arm.Grab(obj, relation)
+
+def compareBackends(arm, obstacles, qs):
+    '''Check each configuration with both backends
+    @param arm Manipulator
+    @param obstacles List of bodies
+    @param qs NxM array of configurations
+    @return List of (q, pairwise, contact) where the verdicts differ and
+            the number of configurations in collision'''
+    pairwise_fn = arm.get_collisionfn(obstacles, backend=pb_robot.collisions.PAIRWISE)
+    contact_fn = arm.get_collisionfn(obstacles, backend=pb_robot.collisions.CONTACT)
+    mismatches = []
+    num_collisions = 0
+    for q in qs:
+        # Moves the grabbed object along, the collision functions only set the arm joints
+        arm.SetJointValues(q)
+        pairwise = pairwise_fn(q)
+        contact = contact_fn(q)
+        num_collisions += pairwise
+        if pairwise != contact:
+            mismatches.append((q, pairwise, contact))
+    return mismatches, num_collisions
+
+def main():
+    pb_robot.utils.connect(use_gui=False)
+    pb_robot.utils.disable_real_time()
+
+    robot = pb_robot.panda.Panda()
+    arm = robot.arm
+    obstacles = createObstacles()
+    grabbed = pb_robot.utils.create_box(0.04, 0.04, 0.15, mass=0.1)
+    grabbed.set_transform(arm.GetEETransform())
+
+    rng = numpy.random.RandomState(SEED)
+    (lower, upper) = arm.GetJointLimits()
+    qs = rng.uniform(lower, upper, size=(NUM_CONFIGURATIONS, len(lower)))
+
+    failed = False
+    for engine_filters in [False, True]:
+        arm.engine_collision_filters = engine_filters
+        # Re-grab so that the attachment filters follow engine_filters
+        arm.Release(grabbed)
+        arm.SetJointValues(arm.startq)
+        grabObject(arm, grabbed)
+
+        mismatches, num_collisions = compareBackends(arm, obstacles, qs)
+        print('engine_filters={}: {}/{} in collision, {} mismatches'.format(
+              engine_filters, num_collisions, len(qs), len(mismatches)))
+        for q, pairwise, contact in mismatches:
+            print('  q={} pairwise={} contact={}'.format(numpy.round(q, 3).tolist(), pairwise, contact))
+        failed |= (len(mismatches) > 0)
+
+    pb_robot.utils.disconnect()
+    return int(failed)
+
+if __name__ == '__main__':
+    sys.exit(main())
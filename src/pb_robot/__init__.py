@@ -7,6 +7,9 @@ import grasp
 import vobj
 import viz
 import collisions
+import acm
+import kinematics
+import spheres
 import panda
 import wsg50_hand
 import wsg32_hand
@@ -1,4 +1,4 @@
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from itertools import product
 import numpy as np
 import pybullet as p
@@ -8,6 +8,10 @@ BASE_LINK = -1
 CLIENT = 0
 AABB = namedtuple('AABB', ['lower', 'upper'])
 
+# Cached AABBs of static bodies, see get_static_aabb_arrays
+STATIC_AABBS = {}
+BODY_VERSIONS = defaultdict(int)
+
 def aabb_from_points(points):
     return AABB(np.min(points, axis=0), np.max(points, axis=0))
 
@@ -41,6 +45,37 @@ def get_aabb(body, link=None):
 
 get_lower_upper = get_aabb
 
+def get_aabb_arrays(body, links=None):
+    # Lower and upper corners of the link AABBs as two Lx3 arrays
+    if links is None:
+        links = body.all_links
+    aabbs = [p.getAABB(body.id, linkIndex=link.linkID, physicsClientId=CLIENT) for link in links]
+    if len(aabbs) == 0:
+        return np.zeros((0, 3)), np.zeros((0, 3))
+    lower, upper = zip(*aabbs)
+    return np.array(lower), np.array(upper)
+
+def invalidate_aabbs(body_id):
+    # Called whenever a body is moved (pose or joints) or removed
+    BODY_VERSIONS[CLIENT, body_id] += 1
+
+def get_static_aabb_arrays(body):
+    # get_aabb_arrays of all links, recomputed only after the body moved. Only for bodies that are not moved
+    # by the simulation (zero mass obstacles without movable joints), whose link AABBs only depend on the
+    # base pose. The base pose is read back (one call instead of one per link), so that bodies moved with
+    # p.resetBasePositionAndOrientation instead of through pb_robot are caught as well
+    key = (CLIENT, body.id)
+    version = (BODY_VERSIONS[key], p.getBasePositionAndOrientation(body.id, physicsClientId=CLIENT))
+    if (key not in STATIC_AABBS) or (STATIC_AABBS[key][0] != version):
+        STATIC_AABBS[key] = (version, get_aabb_arrays(body))
+    return STATIC_AABBS[key][1]
+
+def aabb_overlap_matrix(lower1, upper1, lower2, upper2, margin=0.):
+    # Vectorized aabb_overlap of N and M AABBs (given by their Nx3 and Mx3 corners) as an NxM boolean array.
+    # AABBs less than margin apart count as overlapping
+    return np.all(np.less_equal(lower1[:, None, :], upper2[None, :, :] + margin), axis=2) & \
+           np.all(np.less_equal(lower2[None, :, :], upper1[:, None, :] + margin), axis=2)
+
 def get_aabb_center(aabb):
     lower, upper = aabb
     return (np.array(lower) + np.array(upper)) / 2.
@@ -0,0 +1,100 @@
+import os
+from itertools import combinations
+import numpy as np
+import pb_robot
+import pb_robot.helper as helper
+from pb_robot.collisions import pairwise_link_collision
+
+# Allowed collision matrix (ACM): link pairs of a robot that never need to be
+# checked for self-collisions. Link pairs are classified by sampling random
+# configurations, pairs that are never or always in collision are disabled.
+# The result is persisted per URDF (by content hash), see get_acm_path
+
+NEVER = 'never'
+ALWAYS = 'always'
+SOMETIMES = 'sometimes'
+
+# Pairs that collide only in a small part of the configuration space are easily never sampled,
+# hence many samples (as in the MoveIt setup assistant). NEVER pairs of an ACM computed with
+# fewer than MIN_NEVER_SAMPLES samples (e.g. a quick run) are still checked
+NUM_SAMPLES = 50000
+MIN_NEVER_SAMPLES = 10000
+
+ACM_FROM_HASH = {}
+
+
+def get_acm_path(urdf_path):
+    return helper.get_cache_path('acm_{}.json'.format(helper.hash_file(urdf_path)))
+
+
+def get_urdf_path(body):
+    info = pb_robot.utils.get_model_info(body.id)
+    if (info is None) or not info.path.endswith('.urdf'):
+        return None
+    return info.path
+
+
+def get_parent_links(body):
+    return {link.linkID: link.parentJoint.get_joint_info().parentIndex for link in body.links}
+
+
+def compute_acm(body, num_samples=NUM_SAMPLES):
+    # Sample configurations of all movable joints and record which (non-adjacent) link pairs collide.
+    # A pair is only checked until it has been seen both in collision and free
+    joints = body.get_movable_joints()
+    lower, upper = zip(*[joint.get_joint_limits() for joint in joints])
+    parents = get_parent_links(body)
+    pairs = [(link1, link2) for link1, link2 in combinations(body.all_links, 2)
+             if (parents.get(link1.linkID) != link2.linkID) and (parents.get(link2.linkID) != link1.linkID)]
+    collisions = np.zeros(len(pairs), dtype=int)
+    checks = np.zeros(len(pairs), dtype=int)
+    old_q = body.get_joint_positions(joints)
+    for _ in range(num_samples):
+        body.set_joint_positions(joints, np.random.uniform(lower, upper))
+        for i, (link1, link2) in enumerate(pairs):
+            if 0 < collisions[i] < checks[i]:
+                continue # Already known to be sometimes in collision
+            checks[i] += 1
+            collisions[i] += pairwise_link_collision(body, link1, body, link2)
+    body.set_joint_positions(joints, old_q)
+
+    acm = {NEVER: [], ALWAYS: [], SOMETIMES: [], 'num_samples': num_samples,
+           'links': {str(link.linkID): link.get_link_name() for link in body.all_links}}
+    for i, (link1, link2) in enumerate(pairs):
+        if collisions[i] == 0:
+            category = NEVER
+        elif collisions[i] == checks[i]:
+            category = ALWAYS
+        else:
+            category = SOMETIMES
+        acm[category].append((link1.linkID, link2.linkID))
+    return acm
+
+
+def save_acm(urdf_path, acm):
+    path = get_acm_path(urdf_path)
+    helper.ensure_dir(path)
+    helper.write_json(path, acm)
+    ACM_FROM_HASH[helper.hash_file(urdf_path)] = acm
+    return path
+
+
+def load_acm(urdf_path):
+    key = helper.hash_file(urdf_path)
+    if key not in ACM_FROM_HASH:
+        path = get_acm_path(urdf_path)
+        ACM_FROM_HASH[key] = helper.read_json(path) if os.path.exists(path) else None
+    return ACM_FROM_HASH[key]
+
+
+def get_disabled_collisions(body):
+    # Link id pairs whose self-collisions never need to be checked.
+    # Empty if no ACM has been generated for the body's URDF (see scripts/generate_acm.py)
+    urdf_path = get_urdf_path(body)
+    acm = load_acm(urdf_path) if urdf_path is not None else None
+    if acm is None:
+        return set()
+    disabled = list(acm[ALWAYS])
+    if acm.get('num_samples', 0) >= MIN_NEVER_SAMPLES:
+        disabled.extend(acm[NEVER])
+    return {tuple(pair) for pair in disabled}
@@ -8,6 +8,17 @@ from .link import Link
 
 CLIENT = 0
 
+# Bumped whenever bodies are removed, as pybullet reuses their ids
+STRUCTURE_VERSIONS = defaultdict(int)
+
+# Older versions of pybullet can only reset one joint at a time
+RESET_MULTI_DOF = hasattr(p, 'resetJointStatesMultiDof')
+
+# Shared Body wrappers per (client, body id) and the registered body ids per (client, body name), see get_body
+BODY_FROM_ID = {}
+NAME_FROM_ID = {}
+BODY_IDS_FROM_NAME = defaultdict(set)
+
 JOINT_TYPES = {
     p.JOINT_REVOLUTE: 'revolute', # 0
     p.JOINT_PRISMATIC: 'prismatic', # 1
@@ -18,6 +29,38 @@ JOINT_TYPES = {
     p.JOINT_GEAR: 'gear', # 6
 }
 
+def get_body(bodyID):
+    # The shared wrapper of a body, created (and registered) on first use
+    key = (CLIENT, bodyID)
+    if key not in BODY_FROM_ID:
+        Body(bodyID)
+    return BODY_FROM_ID[key]
+
+def register_body(body):
+    # Bodies register themselves when constructed. A plain Body is replaced by a specialized
+    # wrapper of the same body (e.g. Panda), but never the other way around
+    key = (body.client, body.id)
+    current = BODY_FROM_ID.get(key)
+    if (current is None) or ((type(current) is Body) and (type(body) is not Body)):
+        if key not in NAME_FROM_ID:
+            NAME_FROM_ID[key] = body.get_body_name()
+            BODY_IDS_FROM_NAME[body.client, NAME_FROM_ID[key]].add(body.id)
+        BODY_FROM_ID[key] = body
+
+def unregister_body(bodyID):
+    # Called when a body is removed or its id is taken by a new body, as pybullet reuses ids
+    key = (CLIENT, bodyID)
+    BODY_FROM_ID.pop(key, None)
+    if key in NAME_FROM_ID:
+        BODY_IDS_FROM_NAME[CLIENT, NAME_FROM_ID.pop(key)].discard(bodyID)
+
+def clear_bodies():
+    # Called when the simulation is reset
+    for client, bodyID in list(BODY_FROM_ID) + list(NAME_FROM_ID):
+        if client == CLIENT:
+            unregister_body(bodyID)
+    STRUCTURE_VERSIONS[CLIENT] += 1
+
 def createBody(path, **kwargs):
     with pb_robot.helper.HideOutput():
         with pb_robot.utils.LockRenderer():
@@ -34,6 +77,7 @@ class Body(object):
     def __init__(self, bodyID, path=None):
         #self.id = utils.load_model(info, **kwargs)
         self.id = bodyID
+        self.client = CLIENT
         self.base_link = -1
         self.static_mass = 0
         self.BodyInfo = BodyInfo
@@ -56,12 +100,26 @@ class Body(object):
             self.readableName = ((path.split('/')[-1]).split('.'))[0]
         else:
             self.readableName = None
-        self.all_link_children = None
+        register_body(self)
 
     def __repr__(self):
         if self.readableName is None: return self.get_name()
         else: return self.readableName
 
+    # Bodies are identified by their (client, id), not by the python object
+    def __eq__(self, other):
+        if not isinstance(other, Body):
+            return NotImplemented
+        return (self.client, self.id) == (other.client, other.id)
+
+    def __ne__(self, other):
+        if not isinstance(other, Body):
+            return NotImplemented
+        return (self.client, self.id) != (other.client, other.id)
+
+    def __hash__(self):
+        return hash((self.client, self.id))
+
     def get_info(self):
         return self.BodyInfo(*p.getBodyInfo(self.id, physicsClientId=CLIENT))
 
@@ -78,9 +136,12 @@ class Body(object):
         return '{}{}'.format(name, int(self.id))
 
     def remove_body(self):
-        if (CLIENT, self.id) in pb_robot.utils.INFO_FROM_BODY:
-            del pb_robot.utils.INFO_FROM_BODY[CLIENT, self.id]
-        return p.removeBody(self.id, physicsClientId=CLIENT)
+        pb_robot.utils.INFO_FROM_BODY.pop((self.client, self.id), None)
+        pb_robot.aabb.invalidate_aabbs(self.id)
+        unregister_body(self.id)
+        pb_robot.collisions.clear_collision_filters(self.id)
+        STRUCTURE_VERSIONS[self.client] += 1
+        return p.removeBody(self.id, physicsClientId=self.client)
 
     def set_color(self, color):
         p.changeVisualShape(self.id, -1, rgbaColor=color)
@@ -110,6 +171,7 @@ class Body(object):
     def set_pose(self, pose):
         (point, quat) = pose
         p.resetBasePositionAndOrientation(self.id, point, quat, physicsClientId=CLIENT)
+        pb_robot.aabb.invalidate_aabbs(self.id)
         ##
         # If exists grabbed object, update its position too
         if len(self.grabbedObjects.keys()) > 0:
@@ -155,33 +217,22 @@ class Body(object):
         return True
 
     def joint_from_name(self, name): 
-        for j in self.joints:
-            if j.get_joint_name() == name:
-                return j
-        raise ValueError
+        joint_ids = pb_robot.joint.get_joint_table(self).joint_ids
+        if name not in joint_ids:
+            raise ValueError(self, name)
+        return self.joints[joint_ids[name]]
 
     def link_from_name(self, name):
-        if name == self.get_base_name():
-            #return self.base_link
-            return Link(self, self.base_link)
-        for link in self.links:
-            if link.get_link_name() == name:
-                return link
-        raise ValueError(self, name)
+        link_ids = pb_robot.joint.get_joint_table(self).link_ids
+        if name not in link_ids:
+            raise ValueError(self, name)
+        return self.all_links[link_ids[name] + 1]
 
     def has_joint(self, name):
-        try:
-            self.joint_from_name(name)
-        except ValueError:
-            return False
-        return True
+        return name in pb_robot.joint.get_joint_table(self).joint_ids
 
     def has_link(self, name):
-        try:
-            self.link_from_name(name)
-        except ValueError:
-            return False
-        return True
+        return name in pb_robot.joint.get_joint_table(self).link_ids
 
     def joints_from_names(self, names):
         return tuple(self.joint_from_name(name) for name in names)
@@ -243,7 +294,14 @@ class Body(object):
         return [j.get_joint_name() for j in self.format_joint_input(joints)]
 
     def get_joint_positions(self, joints=None):
-        return tuple(j.get_joint_position() for j in self.format_joint_input(joints))
+        return tuple(self.get_joint_positions_by_id(self.get_joint_ids(joints)))
+
+    def get_joint_positions_by_id(self, joint_ids):
+        # Positions of the joints with the given (precomputed) ids as an array, from one getJointStates
+        if len(joint_ids) == 0:
+            return numpy.zeros(0)
+        states = p.getJointStates(self.id, joint_ids, physicsClientId=CLIENT)
+        return numpy.array([state[0] for state in states], dtype=float)
 
     def get_joint_velocities(self, joints=None):
         return tuple(j.get_joint_velocity() for j in self.format_joint_input(joints))
@@ -259,14 +317,33 @@ class Body(object):
 
     def set_joint_positions(self, joints, values): 
         assert len(joints) == len(values)
-        for joint, value in zip(self.format_joint_input(joints), values):
-            joint.set_joint_position(value)
+        self.set_joint_positions_by_id(self.get_joint_ids(joints), values)
+
+    def set_joint_positions_by_id(self, joint_ids, values):
+        # Reset the joints with the given (precomputed) ids at zero velocity, with one
+        # resetJointStatesMultiDof if available (and only for single dof joints)
+        if RESET_MULTI_DOF and (len(joint_ids) > 0):
+            p.resetJointStatesMultiDof(self.id, joint_ids, [[value] for value in values],
+                                       targetVelocities=[[0.]]*len(joint_ids), physicsClientId=CLIENT)
+        else:
+            for jointID, value in zip(joint_ids, values):
+                p.resetJointState(self.id, jointID, value, targetVelocity=0, physicsClientId=CLIENT)
+        pb_robot.aabb.invalidate_aabbs(self.id)
+
+    def get_joint_ids(self, joints=None):
+        return [joint.jointID for joint in self.format_joint_input(joints)]
 
     def get_min_limits(self, joints=None):
-        return [joint.get_min_limit() for joint in self.format_joint_input(joints)]
+        return pb_robot.joint.get_joint_table(self).lower_limits[self.get_joint_ids(joints)]
 
     def get_max_limits(self, joints=None):
-        return [joint.get_max_limit() for joint in self.format_joint_input(joints)]
+        return pb_robot.joint.get_joint_table(self).upper_limits[self.get_joint_ids(joints)]
+
+    def get_max_velocities(self, joints=None):
+        return pb_robot.joint.get_joint_table(self).max_velocities[self.get_joint_ids(joints)]
+
+    def get_max_forces(self, joints=None):
+        return pb_robot.joint.get_joint_table(self).max_forces[self.get_joint_ids(joints)]
 
     def movable_from_joints(self, joints=None):
         fjoints = self.format_joint_input(joints)
@@ -303,21 +380,16 @@ class Body(object):
                            self.get_adjacent_links()))
 
     def are_links_adjacent(self, link1, link2):
-        return (link1.get_link_parent() == link2) or \
-               (link2.get_link_parent() == link1)
+        parents = pb_robot.joint.get_joint_table(self).parents
+        return ((link1.linkID != self.base_link) and (parents[link1.linkID] == link2.linkID)) or \
+               ((link2.linkID != self.base_link) and (parents[link2.linkID] == link1.linkID))
 
     def get_all_link_parents(self):
         return {link: link.get_link_parent() for link in self.links}
 
     def get_all_link_children(self):
-        if self.all_link_children is None:
-            children = {}
-            for child, parent in self.get_all_link_parents().items():
-                if parent not in children:
-                    children[parent] = []
-                children[parent].append(child)
-            self.all_link_children = children
-        return self.all_link_children
+        children = pb_robot.joint.get_joint_table(self).children
+        return {link: link.get_link_children() for link in self.all_links if children[link.linkID + 1]}
 
     def get_fixed_links(self):
         edges = defaultdict(list)
@@ -342,13 +414,10 @@ class Body(object):
         return fixed
 
     def get_moving_links(self, moving_joints):
-        moving_links = set()
-        for joint in moving_joints:
-            link = self.child_link_from_joint(joint)
-            if link not in moving_links:
-                linkType = Link(self, link.jointID)
-                moving_links.update(linkType.get_link_subtree())
-        return list(moving_links)
+        # The child links of the joints and their descendants
+        table = pb_robot.joint.get_joint_table(self)
+        linkIDs = table.get_subtree_ids([self.child_link_from_joint(joint).jointID for joint in moving_joints])
+        return [self.all_links[linkID + 1] for linkID in linkIDs]
 
     def get_relative_pose(self, link1, link2):
         world_from_link1 = link1.get_link_pose()
@@ -374,6 +443,8 @@ class Body(object):
         if linkID is None:
             linkID = self.base_link
         p.changeDynamics(self.id, linkID, physicsClientId=CLIENT, **kwargs)
+        # Joint limits, damping and max velocities can be changed
+        pb_robot.joint.invalidate_joint_table(self)
 
     def set_mass(self, mass, linkID=None):
         if linkID is None:
@@ -8,33 +8,171 @@ MAX_DISTANCE = 0
 CLIENT = 0
 BASE_LINK = -1
 
+# Collision backends, see COLLISION_FNS
+PAIRWISE = 'pairwise'
+CONTACT = 'contact'
+
+# Bodies whose allowed self-collisions have been disabled in the engine
+FILTERED_BODIES = set()
+
 ContactResult = namedtuple('ContactResult', ['contactFlag', 'bodyUniqueIdA', 'bodyUniqueIdB',
                                              'linkIndexA', 'linkIndexB', 'positionOnA', 'positionOnB',
                                              'contactNormalOnB', 'contactDistance', 'normalForce'])
 
 
-def get_collision_fn(body, joints, obstacles, attachments, self_collisions, custom_limits={}, **kwargs):
-    check_link_pairs = get_self_link_pairs(body, joints) if self_collisions else []
+def get_collision_fn(body, joints, obstacles, attachments, self_collisions, custom_limits={},
+                     disabled_collisions=set(), **kwargs):
+    check_link_pairs = get_self_link_pairs(body, joints, disabled_collisions) if self_collisions else []
     moving_links = frozenset(get_moving_links(body, joints))
     moving_bodies = [(body, moving_links)] + attachments
-    check_body_pairs = list(product(moving_bodies, obstacles))  
+    broad_phase_fn = get_broad_phase_fn(moving_bodies, obstacles, kwargs.get('max_distance', MAX_DISTANCE))
     lower_limits, upper_limits = body.get_custom_limits(joints, custom_limits)
+    joint_ids = body.get_joint_ids(joints)
 
     def collision_fn(q):
         if not pb_robot.helper.all_between(lower_limits, q, upper_limits):
             return True
-        body.set_joint_positions(joints, q) 
+        body.set_joint_positions_by_id(joint_ids, q)
         for link1, link2 in check_link_pairs:
             if pairwise_link_collision(body, link1, body, link2):
                 return True
-        for body1, body2 in check_body_pairs:
-            if pairwise_collision(body1, body2, **kwargs): 
+        for (body1, link1), (body2, link2) in broad_phase_fn():
+            if pairwise_link_collision(body1, link1, body2, link2, **kwargs):
+                return True
+        return False
+    return collision_fn
+
+
+def get_contact_collision_fn(body, joints, obstacles, attachments, self_collisions, custom_limits={},
+                             disabled_collisions=set(), max_distance=MAX_DISTANCE, engine_filters=False):
+    # Same interface as get_collision_fn, but all obstacle collisions of a query are found by a single
+    # performCollisionDetection and getContactPoints, which report contacts up to the contactBreakingThreshold
+    # (larger max_distance values are not supported). The engine reports contacts between all bodies,
+    # so only (moving link, obstacle link) contacts are kept, e.g. contacts of grabbed objects with the
+    # robot or between obstacles are ignored.
+    # Self-collisions are still checked pairwise, as the engine only reports them for bodies
+    # loaded with URDF_USE_SELF_COLLISION. Pairs between static (zero mass) links are never reported
+    # either, so those pairs are checked pairwise as well.
+    # With engine_filters, the disabled self-collision pairs are also disabled in the engine (see
+    # set_collision_filters), which changes the physics simulation as well
+    if engine_filters:
+        set_collision_filters(body, disabled_collisions)
+    check_link_pairs = get_self_link_pairs(body, joints, disabled_collisions) if self_collisions else []
+    moving_links = [(body, link) for link in get_moving_links(body, joints)] + \
+                   [(b, link) for b, links in map(expand_links, attachments) for link in links]
+    obstacle_links = [(b, link) for b, links in map(expand_links, obstacles) for link in links]
+    moving_keys = frozenset((b.id, link.linkID) for b, link in moving_links)
+    obstacle_keys = frozenset((b.id, link.linkID) for b, link in obstacle_links)
+    static_pairs = list(product(filter(is_static_link, moving_links), filter(is_static_link, obstacle_links)))
+    lower_limits, upper_limits = body.get_custom_limits(joints, custom_limits)
+    joint_ids = body.get_joint_ids(joints)
+
+    def is_relevant(contact):
+        keyA = (contact.bodyUniqueIdA, contact.linkIndexA)
+        keyB = (contact.bodyUniqueIdB, contact.linkIndexB)
+        return (contact.contactDistance <= max_distance) and \
+            (((keyA in moving_keys) and (keyB in obstacle_keys)) or
+             ((keyB in moving_keys) and (keyA in obstacle_keys)))
+
+    def collision_fn(q):
+        if not pb_robot.helper.all_between(lower_limits, q, upper_limits):
+            return True
+        body.set_joint_positions_by_id(joint_ids, q)
+        for link1, link2 in check_link_pairs:
+            if pairwise_link_collision(body, link1, body, link2):
+                return True
+        p.performCollisionDetection(physicsClientId=CLIENT)
+        if any(is_relevant(ContactResult(*contact[:10]))
+               for contact in p.getContactPoints(physicsClientId=CLIENT)):
+            return True
+        for (body1, link1), (body2, link2) in static_pairs:
+            if pairwise_link_collision(body1, link1, body2, link2, max_distance=max_distance):
                 return True
         return False
     return collision_fn
 
 
+def set_collision_filters(body, disabled_collisions):
+    # Disable the allowed self-collisions (e.g. from the ACM) of the body in the engine, once per body.
+    # These pairs are never checked by the planners, so the engine no longer reports their contacts.
+    # The filters also apply to the physics simulation: the links pass through each other in stepSimulation
+    key = (CLIENT, body.id)
+    if key in FILTERED_BODIES:
+        return
+    for linkID1, linkID2 in disabled_collisions:
+        p.setCollisionFilterPair(body.id, body.id, linkID1, linkID2, enableCollision=0, physicsClientId=CLIENT)
+    FILTERED_BODIES.add(key)
+
+
+def set_attachment_filters(body, attachment, enable):
+    # Enable or disable the engine collisions between a grabbed object and all links of the body
+    # (see Manipulator.Grab). As for set_collision_filters, disabled pairs also pass through each
+    # other in the physics simulation
+    for link in body.all_links:
+        for attachment_link in attachment.all_links:
+            p.setCollisionFilterPair(body.id, attachment.id, link.linkID, attachment_link.linkID,
+                                     enableCollision=int(enable), physicsClientId=CLIENT)
+
+
+def clear_collision_filters(bodyID=None):
+    # Forget which bodies have their filters set, as removed body ids are reused.
+    # Called wherever STRUCTURE_VERSIONS is bumped
+    for key in list(FILTERED_BODIES):
+        if (key[0] == CLIENT) and (bodyID is None or key[1] == bodyID):
+            FILTERED_BODIES.discard(key)
+
+
+def is_static_link(body_link):
+    body, link = body_link
+    return body.get_mass(link.linkID) == pb_robot.utils.STATIC_MASS
+
+
+def get_broad_phase_fn(moving_bodies, obstacles, max_distance=MAX_DISTANCE):
+    # Returns a function that yields the ((body, link), (body, link)) pairs of moving and obstacle links
+    # whose AABBs overlap (within max_distance) and which thus need a narrow phase check.
+    # The AABBs of the moving links are recomputed on every call. Rigid obstacles (no movable joints) with
+    # a static (zero mass) base are not moved by the simulation, so their AABBs are cached until their base
+    # pose changes. Articulated obstacles can be moved by motors or physics, so they are recomputed
+    moving_bodies = [expand_links(b) for b in moving_bodies]
+    moving_links = [(b, link) for b, links in moving_bodies for link in links]
+    obstacles = [expand_links(b) for b in obstacles]
+    obstacle_links = [(b, link) for b, links in obstacles for link in links]
+    # Obstacles given as (body, links) may only cover some of the links, these are always recomputed
+    static = [(links is b.all_links) and b.is_fixed_base() and b.is_rigid_body() for b, links in obstacles]
+
+    def get_obstacle_aabbs():
+        aabbs = [pb_robot.aabb.get_static_aabb_arrays(b) if is_static else pb_robot.aabb.get_aabb_arrays(b, links)
+                 for (b, links), is_static in zip(obstacles, static)]
+        return tuple(np.vstack(corners) for corners in zip(*aabbs))
+
+    def broad_phase_fn():
+        if (len(moving_links) == 0) or (len(obstacle_links) == 0):
+            return
+        lower1, upper1 = (np.vstack(corners) for corners in zip(*[pb_robot.aabb.get_aabb_arrays(b, links)
+                                                                  for b, links in moving_bodies]))
+        lower2, upper2 = get_obstacle_aabbs()
+        overlap = pb_robot.aabb.aabb_overlap_matrix(lower1, upper1, lower2, upper2, margin=max_distance)
+        for i, j in zip(*np.nonzero(overlap)):
+            yield moving_links[i], obstacle_links[j]
+    return broad_phase_fn
+
+
+
+def get_scene_version(bodies):
+    # Changes whenever one of the bodies is added, removed or moved through pb_robot, which bumps
+    # pb_robot.aabb.BODY_VERSIONS and pb_robot.body.STRUCTURE_VERSIONS. Nothing is read back from pybullet,
+    # so motions by the simulation (physics or motors) or raw pybullet calls are not caught
+    return (pb_robot.body.STRUCTURE_VERSIONS[CLIENT],
+            tuple(sorted((body.id, pb_robot.aabb.BODY_VERSIONS[CLIENT, body.id]) for body in bodies)))
+
+COLLISION_FNS = {
+    PAIRWISE: get_collision_fn,
+    CONTACT: get_contact_collision_fn,
+}
+
+
 def get_self_link_pairs(body, joints, disabled_collisions=set(), only_moving=True):
+    # disabled_collisions holds (linkID, linkID) pairs, in either order
     moving_links = get_moving_links(body, joints)
     #fixed_links = list(set(body.links) - set(moving_links))
     moving_links_ids = [l.linkID for l in moving_links]
@@ -45,18 +183,15 @@ def get_self_link_pairs(body, joints, disabled_collisions=set(), only_moving=Tru
     else:
         check_link_pairs.extend(combinations(moving_links, 2))
     check_link_pairs = list(filter(lambda pair: not body.are_links_adjacent(*pair), check_link_pairs))
-    check_link_pairs = list(filter(lambda pair: (pair not in disabled_collisions) and
-                                   (pair[::-1] not in disabled_collisions), check_link_pairs))
+    check_link_pairs = list(filter(lambda pair: not is_pair_disabled(pair, disabled_collisions), check_link_pairs))
     return check_link_pairs
 
+def is_pair_disabled(pair, disabled_collisions):
+    link_ids = (pair[0].linkID, pair[1].linkID)
+    return (link_ids in disabled_collisions) or (link_ids[::-1] in disabled_collisions)
+
 def get_moving_links(body, joints):
-    moving_links = set()
-    for joint in joints:
-        jlink = body.child_link_from_joint(joint)
-        link = pb_robot.link.Link(body, jlink.jointID)
-        if link not in moving_links:
-            moving_links.update(link.get_link_subtree())
-    return list(moving_links)
+    return body.get_moving_links(joints)
 
 def get_moving_pairs(body, moving_joints):
     """
@@ -64,11 +199,15 @@ def get_moving_pairs(body, moving_joints):
     Do not check all fixed and fixed pairs
     Check all moving pairs with a common
     """
+    # Moving links are compared by which of the moving joints are their (joint) ancestors,
+    # i.e. their own parent joint or that of an ancestor link
+    table = pb_robot.joint.get_joint_table(body)
+    moving_ids = [joint.jointID + 1 for joint in moving_joints]
     moving_links = get_moving_links(body, moving_joints)
-    for link1, link2 in combinations(moving_links, 2):
-        ancestors1 = set(link1.get_joint_ancestors()) & set(moving_joints)
-        ancestors2 = set(link2.get_joint_ancestors()) & set(moving_joints)
-        if ancestors1 != ancestors2:
+    signatures = [(table.ancestors[link.linkID + 1, moving_ids] |
+                   (np.array(moving_ids) == link.linkID + 1)).tobytes() for link in moving_links]
+    for (link1, signature1), (link2, signature2) in combinations(zip(moving_links, signatures), 2):
+        if signature1 != signature2:
             yield link1, link2
 
 def pairwise_link_collision(body1, link1, body2, link2=BASE_LINK, max_distance=MAX_DISTANCE): # 10000
@@ -1,12 +1,15 @@
+import anytime
 import discrete
 import graph
 import lazy_prm
 import multi_rrt
+import nearest
 import prm
 import rrt
 import rrt_connect
 import rrt_star
 import smoothing
 import star_roadmap
+import stats
 import utils
 
@@ -0,0 +1,26 @@
+import threading
+import time
+
+
+class CancellationToken(object):
+    """
+    Shared flag used to stop an anytime planner early, e.g. from another thread or from a path callback.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+
+def cancelled(cancel_token=None):
+    return (cancel_token is not None) and cancel_token.is_cancelled()
+
+
+def expired(deadline=None, cancel_token=None):
+    # deadline is an absolute time (as in time.time()), None for no deadline
+    return cancelled(cancel_token) or ((deadline is not None) and (time.time() >= deadline))
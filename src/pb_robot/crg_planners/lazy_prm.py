@@ -1,7 +1,7 @@
 from scipy.spatial.kdtree import KDTree
 from heapq import heappush, heappop
 from collections import namedtuple
-from utils import INF, elapsed_time
+from utils import INF, elapsed_time, finish
 from rrt_connect import direct_path
 from smoothing import smooth_path
 
@@ -82,11 +82,22 @@ def check_path(path, colliding_vertices, colliding_edges, samples, extend_fn, co
             return False
     return True
 
-def lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn, num_samples=100, max_degree=10,
-             weights=None, p_norm=2, max_distance=INF, approximate_eps=0.0,
-             max_cost=INF, max_time=INF, max_paths=INF):
+def lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn, stats=None, **kwargs):
+    # stats (PlannerStats) optionally records where the time went and how planning ended.
+    status, result = lazy_prm_search(start_conf, end_conf, sample_fn, extend_fn, collision_fn,
+                                     stats=stats, **kwargs)
+    return finish(stats, status, result)
+
+def lazy_prm_search(start_conf, end_conf, sample_fn, extend_fn, collision_fn, num_samples=100, max_degree=10,
+                    weights=None, p_norm=2, max_distance=INF, approximate_eps=0.0,
+                    max_cost=INF, max_time=INF, max_paths=INF, stats=None):
     # TODO: multi-query motion planning
+    # Returns the status of the search and the lazy_prm result. Counts and times go to stats (if given),
+    # but the status is left to the caller so that replanning records a single outcome.
     start_time = time.time()
+    if stats is not None:
+        sample_fn = stats.wrap(sample_fn, 'sample')
+        collision_fn = stats.wrap(collision_fn, 'collision', 'collision_checks')
     # TODO: can embed pose and/or points on the robot for other distances
     if weights is None:
         weights = np.ones(len(start_conf))
@@ -120,6 +131,10 @@ def lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn, num_sampl
         neighbors_from_index[v1].add(v2)
     #print(time.time() - start_time, len(edges), float(len(edges))/len(samples))
 
+    if stats is not None:
+        stats.count('vertices', len(samples))
+        stats.count('edges', len(edges) // 2)
+
     colliding_vertices, colliding_edges = {}, {}
     def neighbors_fn(v1):
         for v2 in neighbors_from_index[v1]:
@@ -131,31 +146,48 @@ def lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn, num_sampl
     heuristic_fn = lambda v: visited[v].g if v in visited else INF
     while elapsed_time(start_time) < max_time:
         # TODO: extra cost to prioritize reusing checked edges
-        path = wastar_search(start_index, end_index, neighbors_fn=neighbors_fn,
-                             cost_fn=cost_fn, heuristic_fn=heuristic_fn,
-                             max_cost=max_cost, max_time=max_time-elapsed_time(start_time))
+        if stats is None:
+            path = wastar_search(start_index, end_index, neighbors_fn=neighbors_fn,
+                                 cost_fn=cost_fn, heuristic_fn=heuristic_fn,
+                                 max_cost=max_cost, max_time=max_time-elapsed_time(start_time))
+        else:
+            with stats.timer('search'):
+                path = wastar_search(start_index, end_index, neighbors_fn=neighbors_fn,
+                                     cost_fn=cost_fn, heuristic_fn=heuristic_fn,
+                                     max_cost=max_cost, max_time=max_time-elapsed_time(start_time))
         if path is None:
-            return None, edges, colliding_vertices, colliding_edges
-        cost = sum(cost_fn(v1, v2) for v1, v2 in zip(path, path[1:]))
-        print('Length: {} | Cost: {:.3f} | Vertices: {} | Edges: {} | Time: {:.3f}'.format(
-            len(path), cost, len(colliding_vertices), len(colliding_edges), elapsed_time(start_time)))
+            status = 'timeout' if elapsed_time(start_time) >= max_time else 'infeasible'
+            return status, (None, edges, colliding_vertices, colliding_edges)
+        if stats is not None:
+            stats.count('paths')
         if check_path(path, colliding_vertices, colliding_edges, samples, extend_fn, collision_fn):
             break
+    else:
+        # Out of time before a candidate path was validated
+        return 'timeout', (None, edges, colliding_vertices, colliding_edges)
 
     solution = [start_conf]
     for q1, q2 in zip(path, path[1:]):
         solution.extend(extend_fn(samples[q1], samples[q2]))
-    return solution, samples, edges, colliding_vertices, colliding_edges
+    return 'success', (solution, samples, edges, colliding_vertices, colliding_edges)
 
-def replan_loop(start_conf, end_conf, sample_fn, extend_fn, collision_fn, params_list, smooth=0, **kwargs):
+def replan_loop(start_conf, end_conf, sample_fn, extend_fn, collision_fn, params_list, smooth=0,
+                stats=None, **kwargs):
+    if stats is not None:
+        collision_fn = stats.wrap(collision_fn, 'collision', 'collision_checks')
     if collision_fn(start_conf) or collision_fn(end_conf):
-        return None
+        return finish(stats, 'invalid_endpoints', None)
     path = direct_path(start_conf, end_conf, extend_fn, collision_fn)
     if path is not None:
-        return path
+        return finish(stats, 'direct', path)
     for num_samples in params_list:
-        path = lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn,
-                        num_samples=num_samples, **kwargs)
+        _, result = lazy_prm_search(start_conf, end_conf, sample_fn, extend_fn, collision_fn,
+                                    num_samples=num_samples, stats=stats, **kwargs)
+        path = result[0]
         if path is not None:
-            return smooth_path(path, extend_fn, collision_fn, iterations=smooth)
-    return None
+            if stats is None:
+                return smooth_path(path, extend_fn, collision_fn, iterations=smooth)
+            with stats.timer('smooth'):
+                path = smooth_path(path, extend_fn, collision_fn, iterations=smooth)
+            return finish(stats, 'success', path)
+    return finish(stats, 'infeasible', None)
@@ -0,0 +1,122 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .utils import INF
+
+BRUTE_FORCE_SIZE = 128
+BATCH_SIZE = 256
+
+
+class NearestNeighbors(object):
+    """
+    Incremental nearest neighbor index over configurations.
+    The distance is sqrt(sum_i w_i * d_i^2) where d_i is the (wrapped, for circular joints) joint difference.
+    Small sets are searched by vectorized brute force. Past brute_force_size points, a KD-tree is rebuilt
+    every batch_size insertions and only the points added since the last rebuild are scanned linearly.
+    Points with non-finite values (e.g. dummy roots) and removed points are stored but never returned.
+    """
+
+    def __init__(self, dof, weights=None, circular=None, brute_force_size=BRUTE_FORCE_SIZE,
+                 batch_size=BATCH_SIZE, capacity=1024):
+        self.dof = dof
+        self.weights = np.ones(dof) if weights is None else np.array(weights, dtype=float)
+        self.circular = np.zeros(dof, dtype=bool) if circular is None else np.array(circular, dtype=bool)
+        self.scale = np.sqrt(self.weights)
+        self.brute_force_size = brute_force_size
+        self.batch_size = batch_size
+        self.points = np.empty((capacity, dof))
+        self.finite = np.empty(capacity, dtype=bool)
+        self.valid = np.empty(capacity, dtype=bool)
+        self.size = 0
+        self.kd_tree = None
+        self.kd_indices = None
+        self.num_indexed = 0
+
+    def __len__(self):
+        return self.size
+
+    def difference(self, q, points):
+        diff = points - q
+        if self.circular.any():
+            with np.errstate(invalid='ignore'):
+                diff[:, self.circular] = (diff[:, self.circular] + np.pi) % (2 * np.pi) - np.pi
+        return diff
+
+    def distances(self, q, points):
+        diff = self.difference(q, points)
+        return np.sqrt(np.dot(diff * diff, self.weights))
+
+    def embed(self, points):
+        # Circular joints are embedded on the unit circle. The chord never exceeds the arc,
+        # so embedded distances are a lower bound on the true distances.
+        points = np.atleast_2d(points)
+        linear = self.scale[~self.circular] * points[:, ~self.circular]
+        angles = points[:, self.circular]
+        scale = self.scale[self.circular]
+        return np.hstack([linear, scale * np.cos(angles), scale * np.sin(angles)])
+
+    def add(self, q):
+        if self.size == len(self.points):
+            points = np.empty((2 * len(self.points), self.dof))
+            points[:self.size] = self.points[:self.size]
+            finite = np.empty(2 * len(self.points), dtype=bool)
+            finite[:self.size] = self.finite[:self.size]
+            valid = np.empty(2 * len(self.points), dtype=bool)
+            valid[:self.size] = self.valid[:self.size]
+            self.points, self.finite, self.valid = points, finite, valid
+        index = self.size
+        self.points[index] = q
+        self.finite[index] = np.isfinite(self.points[index]).all()
+        self.valid[index] = self.finite[index]
+        self.size += 1
+        if (self.size > self.brute_force_size) and (self.size - self.num_indexed >= self.batch_size):
+            self.rebuild()
+        return index
+
+    def remove(self, index):
+        # Lazy deletion, the point stays in the KD-tree until the next rebuild
+        self.valid[index] = False
+
+    def restore(self, index):
+        self.valid[index] = self.finite[index]
+
+    def rebuild(self):
+        self.kd_indices = np.flatnonzero(self.valid[:self.size])
+        self.kd_tree = cKDTree(self.embed(self.points[self.kd_indices])) if len(self.kd_indices) else None
+        self.num_indexed = self.size
+
+    def query_tree(self, q):
+        if self.kd_tree is None:
+            return -1, INF
+        embedded = self.embed(q)[0]
+        k = 1
+        while True:
+            k = min(k, len(self.kd_indices))
+            bounds, candidates = self.kd_tree.query(embedded, k=k)
+            bounds, candidates = np.atleast_1d(bounds), np.atleast_1d(candidates)
+            indices = self.kd_indices[candidates]
+            indices = indices[self.valid[indices]]
+            if len(indices) != 0:
+                distances = self.distances(q, self.points[indices])
+                best = np.argmin(distances)
+                # Exact once no unseen point can have a smaller (lower bounded) distance
+                if (k == len(self.kd_indices)) or (bounds[-1] >= distances[best]):
+                    return indices[best], distances[best]
+            elif k == len(self.kd_indices):
+                return -1, INF
+            k *= 2
+
+    def nearest(self, q):
+        q = np.array(q, dtype=float)
+        best, best_distance = self.query_tree(q)
+        start = self.num_indexed
+        if start < self.size:
+            distances = self.distances(q, self.points[start:self.size])
+            distances = np.where(self.valid[start:self.size], distances, INF)
+            index = np.argmin(distances)
+            if (best == -1) or (distances[index] < best_distance):
+                best, best_distance = start + index, distances[index]
+        # Only non-finite or removed points, fall back on the first one
+        if (best == -1) or (best_distance == INF):
+            return 0
+        return int(best)
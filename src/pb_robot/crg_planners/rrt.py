@@ -1,6 +1,7 @@
 from random import random
 
-from .utils import irange, argmin, RRT_ITERATIONS
+from .anytime import cancelled, expired
+from .utils import irange, argmin, finish, RRT_ITERATIONS
 
 
 class TreeNode(object):
@@ -38,32 +39,55 @@ class TreeNode(object):
     __repr__ = __str__
 
 
+def add_node(tree, node, nn=None):
+    tree.append(node)
+    if nn is not None:
+        nn.add(node.config)
+    return node
+
+
+def nearest_node(tree, q, distance, nn=None):
+    # nn is an optional NearestNeighbors index holding the configs of tree in insertion order
+    if nn is None:
+        return argmin(lambda n: distance(n.config, q), tree)
+    return tree[nn.nearest(q)]
+
+
 def configs(nodes):
     if nodes is None:
         return None
     return list(map(lambda n: n.config, nodes))
 
 
-def rrt(start, goal_sample, distance, sample, extend, collision, goal_test=lambda q: False, iterations=RRT_ITERATIONS, goal_probability=.2):
+def rrt(start, goal_sample, distance, sample, extend, collision, goal_test=lambda q: False, iterations=RRT_ITERATIONS, goal_probability=.2,
+        nn_fn=None, stats=None, deadline=None, cancel_token=None):
+    nearest_fn = nearest_node
+    if stats is not None:
+        sample = stats.wrap(sample, 'sample')
+        collision = stats.wrap(collision, 'collision', 'collision_checks')
+        nearest_fn = stats.wrap(nearest_node, 'nn')
     if collision(start):
-        return None
+        return finish(stats, 'invalid_endpoints', None)
     if not callable(goal_sample):
         g = goal_sample
         goal_sample = lambda: g
-    nodes = [TreeNode(start)]
+    nn = nn_fn() if nn_fn is not None else None
+    nodes = []
+    add_node(nodes, TreeNode(start), nn)
     for i in irange(iterations):
+        if expired(deadline, cancel_token):
+            return finish(stats, 'cancelled' if cancelled(cancel_token) else 'timeout', None)
         goal = random() < goal_probability or i == 0
         s = goal_sample() if goal else sample()
 
-        last = argmin(lambda n: distance(n.config, s), nodes)
+        last = nearest_fn(nodes, s, distance, nn)
         for q in extend(last.config, s):
             if collision(q):
                 break
-            last = TreeNode(q, parent=last)
-            nodes.append(last)
+            last = add_node(nodes, TreeNode(q, parent=last), nn)
             if goal_test(last.config):
-                return configs(last.retrace())
+                return finish(stats, 'success', configs(last.retrace()))
         else:
             if goal:
-                return configs(last.retrace())
-    return None
+                return finish(stats, 'success', configs(last.retrace()))
+    return finish(stats, 'iterations', None)
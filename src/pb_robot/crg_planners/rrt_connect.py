@@ -1,71 +1,120 @@
+from .anytime import cancelled, expired
 from .smoothing import smooth_path
-from .rrt import TreeNode, configs
-from .utils import irange, argmin, RRT_ITERATIONS, RRT_RESTARTS, RRT_SMOOTHING
+from .rrt import TreeNode, configs, add_node, nearest_node
+from .utils import irange, bisect_sequence, finish, RRT_ITERATIONS, RRT_RESTARTS, RRT_SMOOTHING
 
 def asymmetric_extend(q1, q2, extend_fn, backward=False):
     if backward:
         return reversed(list(extend_fn(q2, q1)))
     return extend_fn(q1, q2)
 
-def rrt_connect(q1, q2, distance_fn, sample_fn, extend_fn, collision_fn, iterations=RRT_ITERATIONS):
+def rrt_connect(q1, q2, distance_fn, sample_fn, extend_fn, collision_fn, stats=None, **kwargs):
+    # stats (PlannerStats) optionally records where the time went and how planning ended.
+    if stats is not None:
+        collision_fn = stats.wrap(collision_fn, 'collision', 'collision_checks')
+    status, path = rrt_connect_search(q1, q2, distance_fn, sample_fn, extend_fn, collision_fn,
+                                      stats=stats, **kwargs)
+    return finish(stats, status, path)
+
+def rrt_connect_search(q1, q2, distance_fn, sample_fn, extend_fn, collision_fn, iterations=RRT_ITERATIONS,
+                       nn_fn=None, stats=None, deadline=None, cancel_token=None):
     # TODO: collision(q1, q2)
+    # Returns the status of the search and the path (None if not found). Samples, nearest neighbor
+    # queries and nodes go to stats (if given), but the search is not finished, so that it can be
+    # restarted (see birrt). collision_fn is not wrapped, as callers already count its checks
+    nearest_fn = nearest_node
+    if stats is not None:
+        sample_fn = stats.wrap(sample_fn, 'sample')
+        nearest_fn = stats.wrap(nearest_node, 'nn')
     if collision_fn(q1) or collision_fn(q2):
-        return None
-    nodes1, nodes2 = [TreeNode(q1)], [TreeNode(q2)]
+        return 'invalid_endpoints', None
+    # nn_fn optionally creates a NearestNeighbors index per tree
+    nn1, nn2 = (nn_fn(), nn_fn()) if nn_fn is not None else (None, None)
+    nodes1, nodes2 = [], []
+    add_node(nodes1, TreeNode(q1), nn1)
+    add_node(nodes2, TreeNode(q2), nn2)
     for iteration in irange(iterations):
+        if expired(deadline, cancel_token):
+            break
         swap = len(nodes1) > len(nodes2)
         tree1, tree2 = nodes1, nodes2
+        index1, index2 = nn1, nn2
         if swap:
             tree1, tree2 = nodes2, nodes1
+            index1, index2 = nn2, nn1
         s = sample_fn()
 
-        last1 = argmin(lambda n: distance_fn(n.config, s), tree1)
+        last1 = nearest_fn(tree1, s, distance_fn, index1)
         for q in asymmetric_extend(last1.config, s, extend_fn, swap):
             if collision_fn(q):
                 break
-            last1 = TreeNode(q, parent=last1)
-            tree1.append(last1)
+            last1 = add_node(tree1, TreeNode(q, parent=last1), index1)
 
-        last2 = argmin(lambda n: distance_fn(n.config, last1.config), tree2)
+        last2 = nearest_fn(tree2, last1.config, distance_fn, index2)
         for q in asymmetric_extend(last2.config, last1.config, extend_fn, not swap):
             if collision_fn(q):
                 break
-            last2 = TreeNode(q, parent=last2)
-            tree2.append(last2)
+            last2 = add_node(tree2, TreeNode(q, parent=last2), index2)
         else:
+            if stats is not None:
+                stats.count('nodes', len(nodes1) + len(nodes2))
             path1, path2 = last1.retrace(), last2.retrace()
             if swap:
                 path1, path2 = path2, path1
             #print('{} iterations, {} nodes'.format(iteration, len(nodes1) + len(nodes2)))
-            return configs(path1[:-1] + path2[::-1])
-    return None
+            return 'success', configs(path1[:-1] + path2[::-1])
+    if stats is not None:
+        stats.count('nodes', len(nodes1) + len(nodes2))
+    if cancelled(cancel_token):
+        return 'cancelled', None
+    return ('timeout' if expired(deadline) else 'iterations'), None
 
 # TODO: version which checks whether the segment is valid
 
 def direct_path(q1, q2, extend_fn, collision_fn):
     if collision_fn(q1) or collision_fn(q2):
         return None
-    path = [q1]
-    for q in extend_fn(q1, q2):
-        if collision_fn(q):
-            return None
-        path.append(q)
+    path = [q1] + list(extend_fn(q1, q2))
+    # Check in bisection order to find collisions early
+    if any(collision_fn(q) for q in bisect_sequence(path[1:])):
+        return None
     return path
 
 
 def birrt(q1, q2, distance, sample, extend, collision,
-          restarts=RRT_RESTARTS, iterations=RRT_ITERATIONS, smooth=RRT_SMOOTHING):
+          restarts=RRT_RESTARTS, iterations=RRT_ITERATIONS, smooth=RRT_SMOOTHING, nn_fn=None, stats=None,
+          deadline=None, cancel_token=None, callback=None):
+    # stats (PlannerStats) optionally records where the time went and how planning ended.
+    # Planning stops at the (absolute) deadline or on cancellation. callback(path) is called with the
+    # first path found and again with the smoothed path
+    if stats is not None:
+        collision = stats.wrap(collision, 'collision', 'collision_checks')
     if collision(q1) or collision(q2):
-        return None
+        return finish(stats, 'invalid_endpoints', None)
     path = direct_path(q1, q2, extend, collision)
     if path is not None:
-        return path
+        if callback is not None:
+            callback(path)
+        return finish(stats, 'direct', path)
     for attempt in irange(restarts + 1):
-        path = rrt_connect(q1, q2, distance, sample, extend,
-                           collision, iterations=iterations)
+        _, path = rrt_connect_search(q1, q2, distance, sample, extend, collision, iterations=iterations,
+                                     nn_fn=nn_fn, stats=stats, deadline=deadline, cancel_token=cancel_token)
         if path is not None:
             #print('{} attempts'.format(attempt))
+            if callback is not None:
+                callback(path)
             if smooth is None:
-                return path
-            return smooth_path(path, extend, collision, iterations=smooth)
-    return None
+                return finish(stats, 'success', path)
+            if stats is None:
+                path = smooth_path(path, extend, collision, iterations=smooth)
+            else:
+                with stats.timer('smooth'):
+                    path = smooth_path(path, extend, collision, iterations=smooth)
+            if callback is not None:
+                callback(path)
+            return finish(stats, 'success', path)
+        if expired(deadline, cancel_token):
+            break
+    if cancelled(cancel_token):
+        return finish(stats, 'cancelled', None)
+    return finish(stats, 'timeout' if expired(deadline) else 'iterations', None)
@@ -1,7 +1,9 @@
 from random import random
 from time import time
 
-from .utils import INF, argmin
+from .anytime import cancelled, expired
+from .rrt import nearest_node
+from .utils import INF, finish
 
 
 class OptimalNode(object):
@@ -77,24 +79,41 @@ def safe_path(sequence, collision):
     return path
 
 
-def rrt_star(start, goal, distance, sample, extend, collision, radius, max_time=INF, max_iterations=INF, goal_probability=.2, informed=True):
+def rrt_star(start, goal, distance, sample, extend, collision, radius, max_time=INF, max_iterations=INF, goal_probability=.2, informed=True,
+             nn_fn=None, stats=None, deadline=None, cancel_token=None, callback=None):
+    # Anytime: callback(path) is called with the first path found and with every cheaper one after rewiring,
+    # until max_time, max_iterations, the (absolute) deadline or cancellation. The returned path is always reported
+    nearest_fn = nearest_node
+    if stats is not None:
+        sample = stats.wrap(sample, 'sample')
+        collision = stats.wrap(collision, 'collision', 'collision_checks')
+        nearest_fn = stats.wrap(nearest_node, 'nn')
     if collision(start) or collision(goal):
-        return None
+        return finish(stats, 'invalid_endpoints', None)
     nodes = [OptimalNode(start)]
+    nn = nn_fn() if nn_fn is not None else None
+    if nn is not None:
+        nn.add(start)
     goal_n = None
     t0 = time()
     it = 0
-    while (t0 - time()) < max_time and it < max_iterations:
+    reported_cost = [INF]
+
+    def report():
+        if callback is not None and goal_n is not None and goal_n.cost < reported_cost[0]:
+            reported_cost[0] = goal_n.cost
+            callback(goal_n.retrace())
+
+    while (time() - t0) < max_time and it < max_iterations and not expired(deadline, cancel_token):
+        report()
         do_goal = goal_n is None and (it == 0 or random() < goal_probability)
         s = goal if do_goal else sample()
         # Informed RRT*
         if informed and goal_n is not None and distance(start, s) + distance(s, goal) >= goal_n.cost:
             continue
-        if it % 100 == 0:
-            print it, time() - t0, goal_n is not None, do_goal, (goal_n.cost if goal_n is not None else INF)
         it += 1
 
-        nearest = argmin(lambda n: distance(n.config, s), nodes)
+        nearest = nearest_fn(nodes, s, distance, nn)
         path = safe_path(extend(nearest.config, s), collision)
         if len(path) == 0:
             continue
@@ -108,6 +127,8 @@ def rrt_star(start, goal, distance, sample, extend, collision, radius, max_time=
         neighbors = filter(lambda n: distance(
             n.config, new.config) < radius, nodes)
         nodes.append(new)
+        if nn is not None:
+            nn.add(new.config)
 
         for n in neighbors:
             d = distance(n.config, new.config)
@@ -121,6 +142,17 @@ def rrt_star(start, goal, distance, sample, extend, collision, radius, max_time=
                 path = safe_path(extend(new.config, n.config), collision)
                 if len(path) != 0 and distance(n.config, path[-1]) < 1e-6:
                     n.rewire(new, d, path[:-1], iteration=it)
+    if stats is not None:
+        stats.count('iterations', it)
+        stats.count('nodes', len(nodes))
+    if cancelled(cancel_token):
+        status = 'cancelled'
+    elif (time() - t0) >= max_time or expired(deadline):
+        status = 'timeout'
+    else:
+        status = 'iterations'
     if goal_n is None:
-        return None
-    return goal_n.retrace()
+        return finish(stats, status, None)
+    # Improvements of the last iteration
+    report()
+    return finish(stats, 'success', goal_n.retrace())
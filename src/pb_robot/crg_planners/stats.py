@@ -0,0 +1,120 @@
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class PlannerStats(object):
+    """
+    Statistics of a single plan.
+    Times are accumulated per category (sample, nn, collision, fk, ik, smooth, ...) and may nest,
+    e.g. smoothing time includes the collision checks done while smoothing.
+    Counts are accumulated per event (nodes, edge_checks, collision_checks, ik_attempts, ...).
+    Caches (anything with hits and misses counters) can be tracked, their hits and misses during the plan are counted.
+    seeds holds the seeds of helper processes (e.g. the goal sampler), by name.
+    When planning ends, finish records the status (success, timeout, ...) and passes the stats to each sink.
+    """
+
+    def __init__(self, planner=None, seed=None, sinks=()):
+        self.planner = planner
+        self.seed = seed
+        self.seeds = {}
+        self.sinks = list(sinks)
+        self.status = None
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.tracked = []
+        self.start_time = time.time()
+
+    def __repr__(self):
+        return 'PlannerStats({}, {}, {:.3f}s)'.format(self.planner, self.status, self.times['total'])
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.times[name] += time.time() - start
+
+    def count(self, name, num=1):
+        self.counts[name] += num
+
+    def wrap(self, fn, timer_name, count_name=None):
+        # Wrapping is idempotent, so nested planners can wrap the functions they are passed
+        if getattr(fn, 'stats', None) is self:
+            return fn
+
+        def wrapped(*args, **kwargs):
+            if count_name is not None:
+                self.counts[count_name] += 1
+            with self.timer(timer_name):
+                return fn(*args, **kwargs)
+        wrapped.stats = self
+        return wrapped
+
+    def track(self, name, cache):
+        self.tracked.append((name, cache, cache.hits, cache.misses))
+
+    def finish(self, status):
+        self.status = status
+        self.times['total'] = time.time() - self.start_time
+        for name, cache, hits, misses in self.tracked:
+            self.counts[name + '_hits'] += cache.hits - hits
+            self.counts[name + '_misses'] += cache.misses - misses
+        self.tracked = []
+        for sink in self.sinks:
+            sink.record(self)
+        return self
+
+    def to_dict(self):
+        return {'planner': self.planner,
+                'seed': self.seed,
+                'seeds': dict(self.seeds),
+                'status': self.status,
+                'times': dict(self.times),
+                'counts': dict(self.counts)}
+
+
+class JsonLinesSink(object):
+    """
+    Appends the statistics of each plan as one json line to a file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, stats):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(stats.to_dict()) + '\n')
+
+
+class StatsAggregator(object):
+    """
+    Keeps the statistics of all plans in memory.
+    summary() returns the number of plans, the count of each status and the total and mean of every time and count.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def record(self, stats):
+        self.records.append(stats.to_dict())
+
+    def summary(self):
+        statuses = defaultdict(int)
+        totals = {'times': defaultdict(float), 'counts': defaultdict(int)}
+        for record in self.records:
+            statuses[record['status']] += 1
+            for kind in totals:
+                for name, value in record[kind].items():
+                    totals[kind][name] += value
+        num = max(len(self.records), 1)
+        summary = {'plans': len(self.records), 'status': dict(statuses)}
+        for kind in totals:
+            summary[kind] = dict((name, {'total': value, 'mean': value / float(num)})
+                                 for name, value in totals[kind].items())
+        return summary
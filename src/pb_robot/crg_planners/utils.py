@@ -1,3 +1,4 @@
+from collections import deque
 from random import shuffle
 from itertools import islice
 import time
@@ -24,6 +25,32 @@ def argmin(function, sequence):
     return values[scores.index(min(scores))]
 
 
+def bisect_order(n):
+    # Van der Corput (recursive bisection) ordering of range(n)
+    order = []
+    queue = deque([(0, n - 1)])
+    while queue:
+        lower, upper = queue.popleft()
+        if upper < lower:
+            continue
+        middle = (lower + upper) // 2
+        order.append(middle)
+        queue.extend([(lower, middle - 1), (middle + 1, upper)])
+    return order
+
+
+def bisect_sequence(sequence):
+    sequence = list(sequence)
+    return [sequence[i] for i in bisect_order(len(sequence))]
+
+
+def finish(stats, status, path):
+    # Record how planning ended (if stats are kept) and pass the path through
+    if stats is not None:
+        stats.finish(status)
+    return path
+
+
 def pairs(lst):
     return zip(lst[:-1], lst[1:])
 
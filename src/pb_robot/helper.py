@@ -5,6 +5,7 @@ import platform
 import sys
 import datetime
 import random
+from collections import OrderedDict
 import numpy as np
 
 INF = np.inf
@@ -78,6 +79,17 @@ def ensure_dir(f):
     if not os.path.exists(d):
         os.makedirs(d)
 
+def hash_file(path):
+    # Content hash, so cached results follow edits of the file but not moves
+    import hashlib
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def get_cache_path(filename):
+    # Results computed offline are stored under $PB_ROBOT_CACHE (default ~/.cache/pb_robot)
+    directory = os.environ.get('PB_ROBOT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'pb_robot'))
+    return os.path.join(directory, filename)
+
 def safe_zip(sequence1, sequence2):
     assert len(sequence1) == len(sequence2)
     return zip(sequence1, sequence2)
@@ -163,3 +175,36 @@ class HideOutput(object):
         os.close(self._oldstdout_fno) # Added
 
 #####################################
+
+
+class LRUCache(object):
+    '''
+    Dictionary of at most size items, the least recently used item is
+    evicted first. Counts the hits and misses of get
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        value = self.items.pop(key)
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
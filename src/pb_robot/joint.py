@@ -1,6 +1,8 @@
 from collections import namedtuple
+import numpy
 import pybullet as p
 import pb_robot
+import pb_robot.aabb as aabb
 import pb_robot.helper as helper
 import pb_robot.geometry as geometry
 
@@ -14,6 +16,79 @@ JointInfo = namedtuple('JointInfo', ['jointIndex', 'jointName', 'jointType',
 JointState = namedtuple('JointState', ['jointPosition', 'jointVelocity',
                                        'jointReactionForces', 'appliedJointMotorTorque'])
 
+# Static joint properties per (client, body id), see get_joint_table
+JOINT_TABLES = {}
+
+
+def get_joint_table(body):
+    # Shared JointTable of the body (in its client), rebuilt if bodies were removed (as ids are reused)
+    key = (body.client, body.id)
+    version = pb_robot.body.STRUCTURE_VERSIONS[body.client]
+    if (key not in JOINT_TABLES) or (JOINT_TABLES[key][0] != version):
+        JOINT_TABLES[key] = (version, JointTable(body.id, body.client))
+    return JOINT_TABLES[key][1]
+
+
+def invalidate_joint_table(body):
+    # Called when the joint properties change, i.e. by changeDynamics (see Body.set_dynamics)
+    JOINT_TABLES.pop((body.client, body.id), None)
+
+
+class JointTable(object):
+    """
+    Static properties of all joints of a body, read once with getJointInfo.
+    infos holds the JointInfo of each joint, the arrays are indexed by joint id.
+    The limits are those of Joint.get_joint_limits, so CIRCULAR_LIMITS for circular joints.
+    joint_ids and link_ids index the joints and links (-1 is the base) by name.
+    The kinematic tree tables are indexed by link id + 1: children lists the child link ids and
+    ancestors[a, b] is True if link b - 1 is an ancestor of link a - 1 (descendants is its transpose).
+    """
+
+    def __init__(self, bodyID, client=CLIENT):
+        num_joints = p.getNumJoints(bodyID, physicsClientId=client)
+        self.infos = [JointInfo(*p.getJointInfo(bodyID, j, physicsClientId=client)) for j in range(num_joints)]
+        self.names = [info.jointName for info in self.infos]
+        self.types = numpy.array([info.jointType for info in self.infos], dtype=int)
+        self.parents = numpy.array([info.parentIndex for info in self.infos], dtype=int)
+        self.axes = numpy.array([info.jointAxis for info in self.infos], dtype=float).reshape(-1, 3)
+        self.max_velocities = numpy.array([info.jointMaxVelocity for info in self.infos], dtype=float)
+        self.max_forces = numpy.array([info.jointMaxForce for info in self.infos], dtype=float)
+        lower = numpy.array([info.jointLowerLimit for info in self.infos], dtype=float)
+        upper = numpy.array([info.jointUpperLimit for info in self.infos], dtype=float)
+        self.movable = self.types != p.JOINT_FIXED
+        self.circular = self.movable & (upper < lower)
+        self.lower_limits = numpy.where(self.circular, pb_robot.utils.CIRCULAR_LIMITS[0], lower)
+        self.upper_limits = numpy.where(self.circular, pb_robot.utils.CIRCULAR_LIMITS[1], upper)
+        # Name indexes, the first match wins on duplicate names (as in a linear scan)
+        self.base_name = p.getBodyInfo(bodyID, physicsClientId=client)[0].decode(encoding='UTF-8')
+        self.joint_ids = {}
+        self.link_ids = {}
+        for info in reversed(self.infos):
+            self.joint_ids[info.jointName] = info.jointIndex
+            self.link_ids[info.linkName.decode('UTF-8')] = info.jointIndex
+        self.link_ids[self.base_name] = -1
+        # Kinematic tree, parents always have lower ids than their children
+        self.children = [[] for _ in range(num_joints + 1)]
+        self.ancestors = numpy.zeros((num_joints + 1, num_joints + 1), dtype=bool)
+        for linkID, parent in enumerate(self.parents):
+            self.children[parent + 1].append(linkID)
+            self.ancestors[linkID + 1] = self.ancestors[parent + 1]
+            self.ancestors[linkID + 1, parent + 1] = True
+        self.descendants = self.ancestors.T
+
+    def get_ancestor_ids(self, linkID):
+        # Ids of the ancestors of a link, starting from the base
+        return [int(i) - 1 for i in numpy.flatnonzero(self.ancestors[linkID + 1])]
+
+    def get_subtree_ids(self, linkIDs):
+        # Ids of the links and all their descendants, in increasing order
+        subtree = numpy.zeros(len(self.children), dtype=bool)
+        for linkID in linkIDs:
+            subtree[linkID + 1] = True
+            subtree |= self.descendants[linkID + 1]
+        return [int(i) - 1 for i in numpy.flatnonzero(subtree)]
+
+
 class Joint(object): # inherit what?
     def __init__(self, body, jointID):
         self.body = body
@@ -23,7 +98,8 @@ class Joint(object): # inherit what?
         self.JointState = JointState
 
     def get_joint_info(self):
-        return self.JointInfo(*p.getJointInfo(self.bodyID, self.jointID, physicsClientId=CLIENT))
+        # Joint info is static, so it is read once per body (see JointTable)
+        return get_joint_table(self.body).infos[self.jointID]
 
     def get_joint_name(self):
         return self.get_joint_info().jointName # .decode('UTF-8')
@@ -53,10 +129,7 @@ class Joint(object): # inherit what?
         return not self.is_fixed()
 
     def is_circular(self):
-        joint_info = self.get_joint_info()
-        if joint_info.jointType == p.JOINT_FIXED:
-            return False
-        return joint_info.jointUpperLimit < joint_info.jointLowerLimit
+        return bool(get_joint_table(self.body).circular[self.jointID])
 
     def get_joint_limits(self):
         if self.is_circular():
@@ -93,6 +166,7 @@ class Joint(object): # inherit what?
 
     def set_joint_position(self, value):
         p.resetJointState(self.bodyID, self.jointID, value, targetVelocity=0, physicsClientId=pb_robot.utils.CLIENT)
+        aabb.invalidate_aabbs(self.bodyID)
 
     def violates_limit(self, value):
         if self.is_circular():
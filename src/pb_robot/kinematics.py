@@ -0,0 +1,148 @@
+import numpy as np
+import pybullet as p
+import pb_robot
+import pb_robot.geometry as geometry
+
+CLIENT = 0
+
+# Kinematic chains per (client, body id), see get_kinematic_chain
+CHAIN_FROM_BODY = {}
+
+
+def get_kinematic_chain(body):
+    # Shared KinematicChain of the body, rebuilt if bodies were removed (as ids are reused)
+    key = (body.client, body.id)
+    version = pb_robot.body.STRUCTURE_VERSIONS[body.client]
+    if (key not in CHAIN_FROM_BODY) or (CHAIN_FROM_BODY[key][0] != version):
+        CHAIN_FROM_BODY[key] = (version, KinematicChain(body))
+    return CHAIN_FROM_BODY[key][1]
+
+
+def axis_rotations(axis, angles):
+    # Nx4x4 rotations about the (unit) axis by each of the N angles (Rodrigues' formula)
+    x, y, z = axis
+    K = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+    angles = np.asarray(angles)[:, None, None]
+    tforms = np.tile(np.eye(4), (len(angles), 1, 1))
+    tforms[:, :3, :3] += np.sin(angles)*K + (1 - np.cos(angles))*K.dot(K)
+    return tforms
+
+
+def axis_translations(axis, distances):
+    # Nx4x4 translations along the (unit) axis by each of the N distances
+    tforms = np.tile(np.eye(4), (len(distances), 1, 1))
+    tforms[:, :3, 3] = np.outer(distances, axis)
+    return tforms
+
+
+class KinematicChain(object):
+    """
+    Forward kinematics of a body in numpy, for many configurations at once and without changing the simulation state.
+    Joint origins, axes and inertial frames are read once from the simulator (getJointInfo, getDynamicsInfo).
+    As in pybullet, each joint frame is given relative to the inertial (center of mass) frame of its parent link
+    and the base pose is the pose of the base inertial frame. Returned link frames are the (URDF) link frames,
+    as in Link.get_link_pose, with the base link at index 0 and link i at index i + 1.
+    Revolute, prismatic and fixed joints are supported.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.num_joints = body.num_joints
+        infos = [joint.get_joint_info() for joint in body.joints]
+        self.parents = np.array([info.parentIndex for info in infos], dtype=int)
+        self.types = [info.jointType for info in infos]
+        for info in infos:
+            if info.jointType not in (p.JOINT_REVOLUTE, p.JOINT_PRISMATIC, p.JOINT_FIXED):
+                raise NotImplementedError('Unsupported joint type {} of {}'.format(
+                    info.jointType, info.jointName.decode('UTF-8')))
+        self.axes = np.array([self.unit(info.jointAxis) for info in infos]).reshape(-1, 3)
+        self.origins = np.array([geometry.tform_from_pose((info.parentFramePos, info.parentFrameOrn))
+                                 for info in infos]).reshape(-1, 4, 4)
+        # Inertial frames relative to the link frames, base link first
+        self.inertials = np.array([geometry.tform_from_pose((info.local_inertial_pos, info.local_inertial_orn))
+                                   for info in map(body.get_dynamics_info, range(-1, self.num_joints))])
+        self.base_inertial_inverse = np.linalg.inv(self.inertials[0])
+
+    @staticmethod
+    def unit(axis):
+        norm = np.linalg.norm(axis)
+        return np.array(axis) / norm if norm > 0 else np.zeros(3)
+
+    def get_positions(self, qs, joints):
+        # NxJ positions of all joints: the given joints set to qs, all others at their current positions
+        qs = np.atleast_2d(qs)
+        current = self.body.get_joint_positions_by_id(range(self.num_joints))
+        positions = np.tile(current, (len(qs), 1))
+        positions[:, [joint.jointID for joint in joints]] = qs
+        return positions
+
+    def get_ancestors(self, linkID):
+        # Ids of the link and all links between it and the base (excluding the base)
+        ancestors = []
+        while linkID != -1:
+            ancestors.append(linkID)
+            linkID = self.parents[linkID]
+        return ancestors
+
+    def get_link_transforms(self, qs, joints, links=None):
+        '''Link frames at many configurations
+        @param qs NxM array of configurations of the M joints, all other
+               joints and the base keep their current state
+        @param joints The M joints
+        @param links Optional ids of the links that are needed, only these
+               and their ancestors are computed (the others are nan)
+        @return Nx(J+1)x4x4 array of link frames in the world'''
+        positions = self.get_positions(qs, joints)
+        num = len(positions)
+        if links is None:
+            indices = range(self.num_joints)
+        else:
+            indices = sorted(set(i for link in links for i in self.get_ancestors(link)))
+        coms = np.full((num, self.num_joints + 1, 4, 4), np.nan)
+        frames = np.full((num, self.num_joints + 1, 4, 4), np.nan)
+        coms[:, 0] = geometry.tform_from_pose(self.body.get_pose())
+        frames[:, 0] = coms[:, 0].dot(self.base_inertial_inverse)
+        for i in indices:
+            joint_frames = np.matmul(coms[:, self.parents[i] + 1], self.origins[i])
+            if self.types[i] == p.JOINT_REVOLUTE:
+                joint_frames = np.matmul(joint_frames, axis_rotations(self.axes[i], positions[:, i]))
+            elif self.types[i] == p.JOINT_PRISMATIC:
+                joint_frames = np.matmul(joint_frames, axis_translations(self.axes[i], positions[:, i]))
+            frames[:, i + 1] = joint_frames
+            coms[:, i + 1] = np.matmul(joint_frames, self.inertials[i + 1])
+        return frames
+
+    def get_link_transform(self, qs, joints, link):
+        '''Nx4x4 frames of a single link (Link or link id) at many configurations'''
+        linkID = link.linkID if hasattr(link, 'linkID') else link
+        return self.get_link_transforms(qs, joints, links=[linkID])[:, linkID + 1]
+
+    def get_jacobians(self, qs, joints, links):
+        '''Geometric Jacobians of links at many configurations. As in
+        calculateJacobian, each Jacobian is taken at the link's center of mass
+        @param qs NxM array of configurations of the M joints
+        @param joints The M joints, the Jacobian columns
+        @param links L links (Link or link id)
+        @return NxLx6xM array, rows are the linear then angular velocity'''
+        linkIDs = [link.linkID if hasattr(link, 'linkID') else link for link in links]
+        frames = self.get_link_transforms(qs, joints, links=linkIDs)
+        jacobians = np.zeros((len(frames), len(linkIDs), 6, len(joints)))
+        for l, linkID in enumerate(linkIDs):
+            ancestors = set(self.get_ancestors(linkID))
+            points = np.matmul(frames[:, linkID + 1], self.inertials[linkID + 1])[:, :3, 3]
+            for j, joint in enumerate(joints):
+                i = joint.jointID
+                if i not in ancestors:
+                    continue
+                # The joint axis is fixed in the child link frame
+                axes = frames[:, i + 1, :3, :3].dot(self.axes[i])
+                if self.types[i] == p.JOINT_REVOLUTE:
+                    jacobians[:, l, :3, j] = np.cross(axes, points - frames[:, i + 1, :3, 3])
+                    jacobians[:, l, 3:, j] = axes
+                elif self.types[i] == p.JOINT_PRISMATIC:
+                    jacobians[:, l, :3, j] = axes
+        return jacobians
+
+    def get_jacobian(self, qs, joints, link):
+        '''Nx6xM Jacobians of a single link (Link or link id) at many configurations'''
+        return self.get_jacobians(qs, joints, [link])[:, 0]
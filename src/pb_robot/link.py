@@ -1,6 +1,7 @@
 from collections import namedtuple
 import numpy
 import pybullet as p
+import pb_robot
 import pb_robot.geometry as geometry
 
 CLIENT = 0
@@ -25,7 +26,6 @@ class Link(object):
         self.LinkState = LinkState
 
         #parent_link_from_joint = get_link_parent
-        self.link_ancestors = None
 
     def get_link_name(self):  
         if self.linkID == self.base_link:
@@ -35,7 +35,8 @@ class Link(object):
     def get_link_parent(self):
         if self.linkID == self.base_link:
             return None
-        return self.body.all_links[self.linkID]
+        parent = pb_robot.joint.get_joint_table(self.body).parents[self.linkID]
+        return self.body.all_links[parent + 1]
 
     def get_link_state(self, kinematics=True, velocity=True):
         # TODO: the defaults are set to False?
@@ -69,21 +70,12 @@ class Link(object):
             return link_objF
 
     def get_link_children(self):
-        children = self.body.get_all_link_children()
-        for c in children.keys():
-            if c.linkID == self.linkID:
-                return children[c]
-        return []
-        #return children.get(self, []) 
+        children = pb_robot.joint.get_joint_table(self.body).children[self.linkID + 1]
+        return [self.body.all_links[c + 1] for c in children]
 
     def get_link_ancestors(self):
-        if self.link_ancestors is None:
-            parent = self.get_link_parent()
-            if parent is None:
-                self.link_ancestors = []
-            else:
-                self.link_ancestors = parent.get_link_ancestors() + [parent]
-        return self.link_ancestors
+        ancestors = pb_robot.joint.get_joint_table(self.body).get_ancestor_ids(self.linkID)
+        return [self.body.all_links[a + 1] for a in ancestors]
 
     def get_joint_ancestors(self): 
         return [l.parentJoint for l in self.get_link_ancestors()] + [self.parentJoint]
@@ -92,11 +84,15 @@ class Link(object):
         return self.body.prune_fixed_joints(self.get_joint_ancestors())
 
     def get_link_descendants(self, test=lambda l: True):
+        # Depth first, the subtrees of links that fail the test are skipped
+        children = pb_robot.joint.get_joint_table(self.body).children
         descendants = []
-        for child in self.get_link_children():
+        stack = list(reversed(children[self.linkID + 1]))
+        while stack:
+            child = self.body.all_links[stack.pop() + 1]
             if test(child):
                 descendants.append(child)
-                descendants.extend(child.get_link_descendants(test=test))
+                stack.extend(reversed(children[child.linkID + 1]))
         return descendants
 
     def get_link_subtree(self, **kwargs):
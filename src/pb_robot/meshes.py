@@ -1,4 +1,5 @@
 from collections import defaultdict, deque, namedtuple
+import numpy as np
 import pb_robot.helper as helper
 
 # Mesh & Pointcloud Files
@@ -92,6 +93,25 @@ def read_obj(path, decompose=True):
     return meshes
 
 
+def read_stl(path, scale=1.0):
+    """
+    Reads a binary or ASCII *.stl mesh file
+    :param path: path to the *.stl mesh file
+    :return: tuple of array of vertices and array of faces (every triangle has its own vertices)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    num_triangles = int(np.frombuffer(data[80:84], dtype='<u4')[0]) if len(data) >= 84 else 0
+    if len(data) == 84 + 50*num_triangles:
+        dtype = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+        triangles = np.frombuffer(data[84:], dtype=dtype)['vertices']
+    else:
+        triangles = np.array([line.split()[1:4] for line in data.decode('ascii', 'ignore').split('\n')
+                              if line.strip().startswith('vertex')], dtype=float)
+    vertices = scale*np.asarray(triangles, dtype=float).reshape(-1, 3)
+    return Mesh(vertices, np.arange(len(vertices)).reshape(-1, 3))
+
+
 def transform_obj_file(obj_string, transformation):
     new_lines = []
     for line in obj_string.split('\n'):
@@ -7,6 +7,12 @@ from panda_controls import PandaControls
 
 from pb_robot.ikfast.ikfast import closest_inverse_kinematics, ikfast_inverse_kinematics
 
+# Self-clearance link pairs per robot model, see Manipulator.GetClearancePairs
+CLEARANCE_PAIRS = {}
+
+# Number of collision functions kept per arm
+COLLISIONFN_CACHE_SIZE = 32
+
 class Panda(pb_robot.body.Body):
     '''Create all the functions for controlling the Panda Robot arm'''
     def __init__(self):
@@ -47,7 +53,7 @@ class Manipulator(object):
         data structures. Eventually it might be nice to read the specific variables
         from a combination of the urdf and a yaml file'''
         self.bodyID = bodyID
-        self.__robot = pb_robot.body.Body(self.bodyID)
+        self.__robot = pb_robot.body.get_body(self.bodyID)
         self.joints = joints
         self.jointsID = [j.jointID for j in self.joints]
         self.eeFrame = self.__robot.link_from_name(eeName)
@@ -56,6 +62,8 @@ class Manipulator(object):
 
         # Eventually add a more fleshed out planning suite
         self.birrt = pb_robot.planners.BiRRTPlanner()
+        self.lazy_birrt = pb_robot.planners.LazyBiRRTPlanner()
+        self.parallel_birrt = pb_robot.planners.ParallelPlanner()
         self.snap = pb_robot.planners.SnapPlanner()
 
         # Add force torque sensor at wrist
@@ -68,6 +76,12 @@ class Manipulator(object):
         # to the arm (normally the grasp matrix)
         self.grabbedRelations = dict()
         self.grabbedObjects = dict()
+        # Counters for the cache key, bumped whenever objects are grabbed or
+        # released and whenever the robot was moved by something else than
+        # the arm (see getCollisionCacheKey)
+        self.grabbed_version = 0
+        self.robot_version = 0
+        self.checked_robot_version = None
 
         # Use IK fast for inverse kinematics
         self.ik_info = ik
@@ -76,7 +90,29 @@ class Manipulator(object):
         if startq is not None:
             self.startq = startq #[0, -numpy.pi/4.0, 0, -0.75*numpy.pi, 0, numpy.pi/2.0, numpy.pi/4.0]
             self.SetJointValues(self.startq)
-        self.collisionfn_cache = {}
+        # Collision functions per set of obstacles, least recently used are evicted
+        self.collisionfn_cache = pb_robot.helper.LRUCache(COLLISIONFN_CACHE_SIZE)
+        # Either check each link pair (PAIRWISE) or all obstacles at once with
+        # the engine's collision detection (CONTACT)
+        self.collision_backend = pb_robot.collisions.PAIRWISE
+        # If True, the CONTACT backend also disables the allowed self-collision
+        # pairs and the pairs of grabbed objects with the robot in the engine.
+        # This saves the engine work, but also changes the physics simulation:
+        # these links pass through each other in stepSimulation
+        self.engine_collision_filters = False
+        self.filteredObjects = set()
+        # If True, configurations are first checked against the obstacles with
+        # the sphere model of the arm (pb_robot.spheres) and the exact obstacle
+        # checks only run for the ones it cannot certify as collision-free
+        self.sphere_checks = False
+        # Optional cache of collision checks, see EnableCollisionCache
+        self.collision_cache = None
+        self.collision_cache_resolution = None
+
+        # Minimum distance between (non-adjacent) links of the robot. Can be
+        # overwritten per link pair in clearance_overrides
+        self.clearance = 0.005 #XXX was distance=0.01. Now its 0.005
+        self.clearance_overrides = dict()
 
     def get_name(self):
         return self.__robot.get_name()
@@ -87,13 +123,17 @@ class Manipulator(object):
     def GetJointValues(self):
         '''Return the robot configuration
         @return Nx1 array of joint values'''
-        return numpy.array(self.__robot.get_joint_positions(self.joints))
+        return self.__robot.get_joint_positions_by_id(self.jointsID)
     
     def SetJointValues(self, q):
         '''Set the robot to configuration q. Update the location of any
         grasped objects.
         @param Nx1 desired configuration'''
-        self.__robot.set_joint_positions(self.joints, q)
+        version = pb_robot.aabb.BODY_VERSIONS[pb_robot.aabb.CLIENT, self.bodyID]
+        self.__robot.set_joint_positions_by_id(self.jointsID, q)
+        if version == self.checked_robot_version:
+            # Moving the arm does not change the state the collision cache is keyed on
+            self.checked_robot_version = pb_robot.aabb.BODY_VERSIONS[pb_robot.aabb.CLIENT, self.bodyID]
 
         #If exists grabbed object, update its position too
         if len(self.grabbedObjects.keys()) > 0:
@@ -118,12 +158,20 @@ class Manipulator(object):
         @param relation Transform of object relative to robot'''
         self.grabbedRelations[obj.get_name()] = relation
         self.grabbedObjects[obj.get_name()] = obj
+        self.grabbed_version += 1
+        if self.engine_collision_filters and (obj.get_name() not in self.filteredObjects):
+            pb_robot.collisions.set_attachment_filters(self.__robot, obj, enable=False)
+            self.filteredObjects.add(obj.get_name())
 
     def Release(self, obj):
         '''Dettach an object by removing it from the grabbed object lists
         @param obj The object to be released'''
         self.grabbedObjects.pop(obj.get_name(), None)
         self.grabbedRelations.pop(obj.get_name(), None)
+        self.grabbed_version += 1
+        if obj.get_name() in self.filteredObjects:
+            pb_robot.collisions.set_attachment_filters(self.__robot, obj, enable=True)
+            self.filteredObjects.remove(obj.get_name())
 
     def GetEETransform(self):
         '''Get the end effector transform
@@ -135,11 +183,22 @@ class Manipulator(object):
         @param configuration q
         @return 4x4 transform of the end effector when the robot is at
                 configuration q'''
-        old_q = self.GetJointValues()
-        self.SetJointValues(q)
-        pose = self.GetEETransform()
-        self.SetJointValues(old_q)
-        return pose 
+        return self.ComputeFKMany([q])[0]
+
+    def ComputeFKMany(self, qs):
+        '''Compute the forward kinematics of many configurations at once,
+        in numpy and without changing the joint values of the robot
+        @param qs NxM array of configurations
+        @return Nx4x4 transforms of the end effector'''
+        chain = pb_robot.kinematics.get_kinematic_chain(self.__robot)
+        return chain.get_link_transform(qs, self.joints, self.eeFrame)
+
+    def ComputeLinkPositions(self, q):
+        '''Compute the world positions of all links at configuration q
+        @param configuration q
+        @return Lx3 array of link frame positions'''
+        chain = pb_robot.kinematics.get_kinematic_chain(self.__robot)
+        return chain.get_link_transforms([q], self.joints)[0, :, :3, 3]
 
     def randomConfiguration(self):
         '''Generate a random configuration inside the position limits
@@ -179,17 +238,79 @@ class Manipulator(object):
                 return self.ComputeIK(transform)
         return q 
 
-    def get_collisionfn(self, obstacles=None, self_collisions=True):
+    def get_obstacles(self, obstacles=None):
+        '''If no set of obstacles given, assume all obstacles in the environment
+        (that aren't the robot and not grasped)'''
         if obstacles is None:
-            # If no set of obstacles given, assume all obstacles in the environment (that aren't the robot and not grasped)
             obstacles = [b for b in pb_robot.utils.get_bodies() if self.get_name() not in b.get_name()
                          and b.get_name() not in self.grabbedObjects.keys()]
+        return obstacles
+
+    def get_collisionfn(self, obstacles=None, self_collisions=True, backend=None):
+        '''Get the (cached) collision function of the arm
+        @param obstacles List of bodies, by default all other bodies
+        @param self_collisions Boolean on whether to include self-collision checks
+        @param backend pb_robot.collisions.PAIRWISE or CONTACT, by default
+               self.collision_backend
+        @return Function q -> True if in collision'''
+        obstacles = self.get_obstacles(obstacles)
+        if backend is None:
+            backend = self.collision_backend
         attachments = [g for g in self.grabbedObjects.values()]
-        key = (frozenset(obstacles), frozenset(attachments), self_collisions)
-        if key not in self.collisionfn_cache:
-            self.collisionfn_cache[key] = pb_robot.collisions.get_collision_fn(
-                self.__robot, self.joints, obstacles, attachments, self_collisions)
-        return self.collisionfn_cache[key]
+        # Body ids are reused once bodies are removed, hence the structure version
+        key = (frozenset(b.id for b in obstacles), frozenset(b.id for b in attachments), self_collisions,
+               backend, self.engine_collision_filters, pb_robot.body.STRUCTURE_VERSIONS[self.__robot.client])
+        collisionfn = self.collisionfn_cache.get(key)
+        if collisionfn is None:
+            # Self-collisions of link pairs in the allowed collision matrix are not checked
+            disabled_collisions = pb_robot.acm.get_disabled_collisions(self.__robot)
+            kwargs = {}
+            if backend == pb_robot.collisions.CONTACT:
+                kwargs['engine_filters'] = self.engine_collision_filters
+            collisionfn = pb_robot.collisions.COLLISION_FNS[backend](
+                self.__robot, self.joints, obstacles, attachments, self_collisions,
+                disabled_collisions=disabled_collisions, **kwargs)
+            self.collisionfn_cache.put(key, collisionfn)
+        return collisionfn
+
+    def get_sphere_checker(self, obstacles):
+        '''Get the (cached) SphereCollisionChecker of the arm for the obstacles'''
+        key = ('spheres', frozenset(b.id for b in obstacles), pb_robot.body.STRUCTURE_VERSIONS[self.__robot.client])
+        checker = self.collisionfn_cache.get(key)
+        if checker is None:
+            checker = pb_robot.spheres.SphereCollisionChecker(self.__robot, self.joints, obstacles)
+            self.collisionfn_cache.put(key, checker)
+        return checker
+
+    def EnableCollisionCache(self, resolution=1e-3, size=100000):
+        '''Cache the results of IsCollisionFree(Many) per configuration,
+        rounded to the resolution. The cache is keyed on the state of the
+        scene (obstacles, other robot joints and grasped objects) as
+        tracked by pb_robot, so it never returns results of a scene that has
+        been changed through pb_robot since. Bodies moved by the simulation or
+        by raw pybullet calls are not tracked, clear self.collision_cache
+        after those. Hits and misses are counted in self.collision_cache
+        @param resolution Joint space resolution, configurations that round
+               to the same multiple of it share their result
+        @param size Maximum number of cached configurations'''
+        self.collision_cache = pb_robot.helper.LRUCache(size)
+        self.collision_cache_resolution = resolution
+
+    def DisableCollisionCache(self):
+        '''Stop caching collision checks'''
+        self.collision_cache = None
+
+    def getCollisionCacheKey(self, obstacles, self_collisions):
+        '''State of everything but the arm that the collision checks depend on,
+        as version counters that pb_robot bumps when bodies are moved, added
+        or removed, so that nothing is read back from pybullet. The robot's
+        version is also bumped by the arm, so it is compared with the version
+        after the last batch of checks or arm motion'''
+        version = pb_robot.aabb.BODY_VERSIONS[pb_robot.aabb.CLIENT, self.bodyID]
+        if version != self.checked_robot_version:
+            self.robot_version += 1
+        robot = (self.robot_version, self.grabbed_version)
+        return (pb_robot.collisions.get_scene_version(obstacles), robot, self_collisions)
 
     def IsCollisionFree(self, q, obstacles=None, self_collisions=True):
         '''Check if a configuration is collision-free. Given any grasped objects
@@ -197,48 +318,122 @@ class Manipulator(object):
         @param q Configuration to check at
         @param self_collisions Boolean on whether to include self-collision checks
         @return Boolean True if without collisions, false otherwise'''
-        # This is to cover that the collision function sets joints, but not using the arm version
-        oldq = self.GetJointValues()
-        self.SetJointValues(q)
+        return bool(self.IsCollisionFreeMany([q], obstacles=obstacles, self_collisions=self_collisions)[0])
 
+    def IsCollisionFreeMany(self, qs, obstacles=None, self_collisions=True, early_exit=False):
+        '''Check a batch of configurations for collisions. The robot state is
+        saved and restored once for the whole batch
+        @param qs MxN array of configurations to check
+        @param self_collisions Boolean on whether to include self-collision checks
+        @param early_exit If True, stop at the first configuration in collision.
+               The configurations after it are not checked and reported as False
+        @return Boolean array of length M, True where collision-free'''
+        qs = numpy.atleast_2d(qs)
+        valid = numpy.zeros(len(qs), dtype=bool)
+        obstacles = self.get_obstacles(obstacles)
         collisionfn = self.get_collisionfn(obstacles=obstacles, self_collisions=self_collisions)
-
-        # Evaluate if in collision
-        val = not collisionfn(q)
+        collisionfns = [collisionfn]*len(qs)
+        if self.sphere_checks and (len(self.grabbedObjects) == 0):
+            # Configurations that the sphere model certifies to be clear of the
+            # obstacles only need the self-collision checks
+            selfcollisionfn = self.get_collisionfn(obstacles=[], self_collisions=self_collisions)
+            certified = self.get_sphere_checker(obstacles).certify(qs)
+            collisionfns = [selfcollisionfn if free else collisionfn for free in certified]
+        cache = self.collision_cache
+        if cache is not None:
+            # The scene does not change within the batch
+            scene_key = self.getCollisionCacheKey(obstacles, self_collisions)
+        oldq = self.GetJointValues()
+        try:
+            for i in xrange(len(qs)):
+                if cache is None:
+                    valid[i] = self.checkCollisionFree(collisionfns[i], qs[i])
+                else:
+                    key = (tuple(numpy.round(qs[i] / self.collision_cache_resolution).astype(int)), scene_key)
+                    result = cache.get(key)
+                    if result is None:
+                        result = self.checkCollisionFree(collisionfns[i], qs[i])
+                        cache.put(key, result)
+                    valid[i] = result
+                if early_exit and not valid[i]:
+                    break
+        finally:
+            # Restore configuration
+            self.SetJointValues(oldq)
+            if cache is not None:
+                self.checked_robot_version = pb_robot.aabb.BODY_VERSIONS[pb_robot.aabb.CLIENT, self.bodyID]
+        return valid
+
+    def checkCollisionFree(self, collisionfn, q):
+        '''Uncached collision and clearance check of IsCollisionFreeMany'''
+        # The collision function sets the joints, but not using the arm version.
+        # So grasped objects need to be moved along separately
+        if len(self.grabbedObjects) > 0:
+            self.SetJointValues(q)
 
         # Robot will error if links get too close (i.e. predicts collision)
         # so we want to insure that the is padding wrt collision-free-ness 
-        distances = self.HasClearance(q)
-
-        # Restore configuration
-        self.SetJointValues(oldq)
-        return val and distances
+        return (not collisionfn(q)) and self.HasClearance(q)
 
     def HasClearance(self, q):
-        #XXX was distance=0.01. Now its 0.005
-        for i in self.__robot.all_links:
-            for j in self.__robot.all_links:
-                linkI = i.linkID
-                linkJ = j.linkID
-                # Dont want to check adjancent links or link 8 (fake hand joint)
-                if (abs(linkI-linkJ) < 2) or (linkI == 8) or (linkJ == 8):
-                    break
-                pts = p.getClosestPoints(self.__robot.id, self.__robot.id, distance=0.005, linkIndexA=linkI, linkIndexB=linkJ)
-                if len(pts) > 0:
-                    return False 
+        '''Check that no two links of the robot are closer than the clearance.
+        The link pairs are precomputed, see GetClearancePairs. Assumes the
+        robot is already at q
+        @param q Configuration
+        @return True if all link pairs have clearance'''
+        for (linkI, linkJ) in self.GetClearancePairs():
+            distance = self.clearance_overrides.get((linkI, linkJ), self.clearance)
+            pts = p.getClosestPoints(self.__robot.id, self.__robot.id, distance=distance, linkIndexA=linkI, linkIndexB=linkJ)
+            if len(pts) > 0:
+                return False 
         return True
 
+    def SetClearance(self, distance, pair=None):
+        '''Set the minimum distance between links
+        @param distance Clearance in meters
+        @param pair Optional (linkA, linkB) link ids to set the clearance of,
+               otherwise the default clearance is set'''
+        if pair is None:
+            self.clearance = distance
+        else:
+            self.clearance_overrides[tuple(sorted(pair, reverse=True))] = distance
+        if self.collision_cache is not None:
+            self.collision_cache.clear()
+
+    def GetClearancePairs(self):
+        '''Link pairs checked by HasClearance, computed once per robot model.
+        All non-adjacent pairs are checked, except for link 8 (fake hand
+        joint), as any of them can get too close in some configuration
+        @return List of (linkA, linkB) link ids, linkA > linkB'''
+        info = pb_robot.utils.get_model_info(self.bodyID)
+        model = info.path if info is not None else (self.__robot.client, self.bodyID)
+        if model not in CLEARANCE_PAIRS:
+            pairs = []
+            for i in self.__robot.all_links:
+                for j in self.__robot.all_links:
+                    linkI = i.linkID
+                    linkJ = j.linkID
+                    # Dont want to check adjancent links or link 8 (fake hand joint)
+                    if (abs(linkI-linkJ) < 2) or (linkI == 8) or (linkJ == 8):
+                        break
+                    pairs.append((linkI, linkJ))
+            CLEARANCE_PAIRS[model] = pairs
+        return CLEARANCE_PAIRS[model]
+
 
     def GetJacobian(self, q): 
-        '''Compute the jacobian at configuration q. The full set of joints
-        (and hence jacobian calculation) includes the finger joints, so
-        we remove those after
+        '''Compute the jacobian at configuration q
         @param q Configuration
-        @return Nx6 array of J(q) '''
-        allq = numpy.append(q, [0, 0]).tolist()
-        (translate, rotate) = pb_robot.planning.compute_jacobian(self.__robot, self.eeFrame, positions=allq)
-        jacobian = numpy.hstack((numpy.array(translate), numpy.array(rotate)))
-        return numpy.transpose(jacobian[0:7, :])
+        @return 6xN array of J(q) '''
+        return self.GetJacobianMany([q])[0]
+
+    def GetJacobianMany(self, qs):
+        '''Compute the jacobians of many configurations at once, in numpy
+        and without changing the joint values of the robot
+        @param qs MxN array of configurations
+        @return Mx6xN array of J(q) '''
+        chain = pb_robot.kinematics.get_kinematic_chain(self.__robot)
+        return chain.get_jacobian(qs, self.joints, self.eeFrame)
 
     def GetCoriolosMatrix(self, q, dq):
         '''Compute C(q, q dot) by calling the inverse dynamics function with 
@@ -260,10 +455,16 @@ class Manipulator(object):
         @param q Configuration
         @param force 6D array of force to check against
         @return check True if within torque limits '''
-        jacobian = self.GetJacobian(q)
-        torques = numpy.dot(numpy.transpose(jacobian), forces)
-        inside = all(numpy.less(abs(torques), self.torque_limits)) # Assuming symmetric
-        return inside
+        return bool(self.InsideTorqueLimitsMany([q], forces)[0])
+
+    def InsideTorqueLimitsMany(self, qs, forces):
+        '''Check if configurations (i.e. of a path) are within torque
+        limits, given force
+        @param qs MxN array of configurations
+        @param force 6D array of force to check against
+        @return Boolean array, True where within torque limits '''
+        torques = numpy.einsum('mij,i->mj', self.GetJacobianMany(qs), forces)
+        return numpy.all(numpy.abs(torques) < self.torque_limits, axis=1) # Assuming symmetric
 
     def GetJointTorques(self):
         '''Read the joint torques simulated in pybullet
@@ -1,2 +1,6 @@
 from birrt import BiRRTPlanner
+from lazy_birrt import LazyBiRRTPlanner
 from snap import SnapPlanner
+from goal_sampler import GoalSampler
+from parallel import ParallelPlanner
+from pb_robot.crg_planners.anytime import CancellationToken
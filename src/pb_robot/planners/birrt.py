@@ -5,11 +5,16 @@
 
 import random
 import time
-from scipy import spatial
-import networkx as nx 
 import numpy
 import util
-from plannerTypes import GoalType, ConstraintType
+from tree import SearchTree, ROOT
+from edge import EdgeValidator
+from goal_sampler import GoalSampler
+from shortcut import Shortcutter
+from pb_robot.crg_planners.anytime import cancelled
+from pb_robot.crg_planners.nearest import NearestNeighbors
+from pb_robot.crg_planners.stats import PlannerStats
+from plannerTypes import GoalType, ConstraintType, TreeType, ShortcutType
 
 class BiRRTPlanner(object):
     '''My implementation of cbirrt, for now without constraining,
@@ -17,10 +22,25 @@ class BiRRTPlanner(object):
     def __init__(self):
         ## Constants 
         self.TOTAL_TIME = 15.0
-        self.SHORTEN_TIME = 1.0 # For video level, 4 seconds
+        self.SHORTEN_TIME = 1.0 # Budget, shortcutting stops early once converged
+        self.SHORTCUT = ShortcutType.GREEDY
         self.PSAMPLE = 0.2 
         self.QSTEP = 1
+        self.CHECK_RESOLUTION = 0.025 # Joint space, a little arbitrary
+        self.CARTESIAN_RESOLUTION = None # If set (in meters), used instead
+        self.GOAL_BUFFER = 0 # TSR goals sampled ahead in a background process, 0 disables
+        self.SEED = None # Random seed of each plan, if None a fresh seed is drawn
+        self.seed = None # Seed of the current plan
+        self.rng = random.Random() # Generators of the current plan, seeded in setup
+        self.np_rng = numpy.random.RandomState()
         self.tstart = None
+        self.deadline = None # Absolute time, replaces TOTAL_TIME when planning anytime
+        self.cancel_token = None
+        self.goal_sampler = None
+
+        # Statistics of the last plan, passed to every sink in stats_sinks
+        self.stats = PlannerStats(self.__class__.__name__)
+        self.stats_sinks = []
 
         self.goal = None
         self.goal_type = None
@@ -82,6 +102,21 @@ class BiRRTPlanner(object):
         path = self.BiRRTPlanner(manip, start, goal_tsr, GoalType.TSR_EE, constraints=constraints, **kw_args)
         return util.generatePath(path)
 
+    def PlanAnytime(self, manip, start, goalLocation, goal_type, deadline, callback=None, cancel_token=None, **kw_args):
+        '''Anytime planning, see BiRRTAnytime. callback is called with the
+        first feasible path as soon as it is found and again with every
+        shorter path found before the deadline
+        @param deadline Absolute time (as in time.time()) to stop at
+        @param callback Function path -> None
+        @param cancel_token Optional CancellationToken to stop early
+        @return Shortest joint trajectory found or None if planning failed'''
+        path = None
+        for path in self.BiRRTAnytime(manip, start, goalLocation, goal_type, deadline,
+                                      cancel_token=cancel_token, **kw_args):
+            if callback is not None:
+                callback(util.generatePath(path))
+        return util.generatePath(path)
+
     def BiRRTPlanner(self, manip, start, goalLocation, goal_type, obstacles=None, constraints=None, grasp=None):
         '''Given start and end goals, plan a path
         @param manip Arm to plan wit
@@ -96,70 +131,168 @@ class BiRRTPlanner(object):
         @param backupDIr Direction to back. Currently we only accept a single
                       direction ([1, 0, 0], [0, 1, 0], [0, 0, 1])
         @param path Given as series of waypoints to be converted to OpenRave trajectory'''
- 
+        self.setup(manip, goalLocation, goal_type, obstacles, constraints, grasp)
+        original_pose = manip.GetJointValues()
+        path_array = None
+        try:
+            path_array = self.search(start)
+            if path_array is not None:
+                path_array = self.shortenPath(path_array)
+        finally:
+            # Reset DOF Values
+            manip.SetJointValues(original_pose) 
+            self.stats.finish(self.stopReason(path_array))
+
+        # Return an openrave trajectory
+        return path_array
+
+    def BiRRTAnytime(self, manip, start, goalLocation, goal_type, deadline, cancel_token=None,
+                     obstacles=None, constraints=None, grasp=None):
+        '''Anytime version of BiRRTPlanner. Generator that yields the first
+        feasible path as soon as it is found (before shortening), then keeps
+        improving until the deadline: the path is shortened and new paths
+        are planned from scratch, each yielded if it is shorter than the
+        best so far. The deadline replaces TOTAL_TIME, SHORTEN_TIME still
+        caps each shortening pass. The manipulator is back at its original
+        configuration whenever a path is yielded
+        @param deadline Absolute time (as in time.time()) to stop at
+        @param cancel_token Optional CancellationToken to stop early
+        @return Generator of increasingly short paths (arrays of joint values)'''
+        self.setup(manip, goalLocation, goal_type, obstacles, constraints, grasp)
+        self.deadline = deadline
+        self.cancel_token = cancel_token
+        original_pose = manip.GetJointValues()
+        best = None
+        try:
+            while not self.timedOut():
+                path = self.search(start)
+                if path is None:
+                    break
+                if best is None:
+                    best = path
+                    manip.SetJointValues(original_pose)
+                    yield path
+                path = self.shortenPath(path)
+                if util.cspaceLength(path) < util.cspaceLength(best):
+                    best = path
+                    manip.SetJointValues(original_pose)
+                    yield path
+        finally:
+            manip.SetJointValues(original_pose)
+            self.stats.finish(self.stopReason(best))
+            self.deadline = None
+            self.cancel_token = None
+
+    def setup(self, manip, goalLocation, goal_type, obstacles, constraints, grasp):
+        '''Store the planning problem, seed the planner's random number
+        generators and start new statistics. The global generators are left
+        untouched'''
         self.manip = manip
         self.goal = goalLocation
         self.goal_type = goal_type
         self.constraints = constraints
         self.grasp = grasp 
         self.obstacles = obstacles
-        original_pose = manip.GetJointValues()
         if self.goal_type == GoalType.TSR_TOOL and self.grasp is None:
             raise ValueError("Planning calls that operate on the tool require the grasp is given")
-
-        # Create two trees
-        Ta = nx.Graph(name='start')
-        Tb = nx.Graph(name='goal') 
+        seed = self.SEED if self.SEED is not None else random.randint(0, 2**31-1)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.np_rng = numpy.random.RandomState(seed)
+        self.stats = PlannerStats(self.__class__.__name__, seed=seed, sinks=self.stats_sinks)
+        if getattr(manip, 'collision_cache', None) is not None:
+            self.stats.track('collision_cache', manip.collision_cache)
+        self.edge_validator = self.createEdgeValidator()
+
+    def search(self, start):
+        '''Grow a new pair of trees from the start and the goal until they
+        connect or planning times out
+        @param start start joint configuration
+        @return path (not shortened) or None if no path was found'''
+        # Create two trees, each with an incremental nearest neighbor index
+        dof = len(start)
+        circular = [j.is_circular() for j in self.manip.joints]
+        Ta = SearchTree(TreeType.START, dof, nn=NearestNeighbors(dof, circular=circular))
+        Tb = SearchTree(TreeType.GOAL, dof, nn=NearestNeighbors(dof, circular=circular))
       
-        Ta.add_node('0s', config=start)
+        Ta.add_node(start)
 
         # If our goal is a joint configuration, that is our final goal.
         # However, if we have a TSR we create a dummy node
         if self.goal_type == GoalType.JOINT:
-            Tb.add_node('0g', config=self.goal)
+            Tb.add_node(self.goal)
         else:
-            dummy_values = numpy.ones((len(manip.GetJointValues())))*numpy.inf
-            Tb.add_node('0g', config=dummy_values)
-        (path_array, _, _) = self.plan(Ta, Tb)
-
-        # Reset DOF Values
-        manip.SetJointValues(original_pose) 
-
-        # Return an openrave trajectory
+            dummy_values = numpy.ones(dof)*numpy.inf
+            Tb.add_node(dummy_values)
+            if self.GOAL_BUFFER > 0 and GoalSampler.available():
+                # The worker seed is derived from the plan seed, as for ParallelPlanner workers
+                sampler_seed = self.seed + 1
+                self.goal_sampler = GoalSampler(self.sampleGoalConfiguration, self.GOAL_BUFFER,
+                                                rngs=(self.rng, self.np_rng), seed=sampler_seed)
+                self.stats.seeds['goal_sampler'] = sampler_seed
+                self.goal_sampler.start()
+        try:
+            (path_array, Ta, Tb) = self.plan(Ta, Tb)
+        finally:
+            if self.goal_sampler is not None:
+                self.goal_sampler.stop()
+                self.goal_sampler = None
+        self.stats.count('nodes', len(Ta) + len(Tb))
         return path_array
 
     def plan(self, Ta, Tb):
         '''Continue sampling and connecting till path or timeout'''
         self.tstart = time.time()
 
-        while (time.time() - self.tstart) < self.TOTAL_TIME:
+        while not self.timedOut():
             (Tgoal, Tstart) = self.getGoalAndStartTree(Ta, Tb)
-            if self.goal_type is not GoalType.JOINT and (Tgoal.number_of_nodes() == 1 or random.random() < self.PSAMPLE):
+            if self.goal_type is not GoalType.JOINT and (len(Tgoal) == 1 or self.rng.random() < self.PSAMPLE):
                 Tgoal = self.addRootConfiguration(Tgoal)
-                # Update trees - (FIND MORE EFFICIENT METHOD)
-                Ta = Tgoal.copy()
-                Tb = Tstart.copy() 
+                (Ta, Tb) = (Tgoal, Tstart)
             else:
-                q_rand = self.randomConfig()
+                with self.stats.timer('sample'):
+                    q_rand = self.randomConfig()
                 qa_near = self.nearestNeighbor(Ta, q_rand)
                 (Ta, qa_reach) = self.constrainedExtend(Ta, qa_near, q_rand)
-                qb_near = self.nearestNeighbor(Tb, Ta.node[qa_reach]['config'])
-                (Tb, qb_reach) = self.constrainedExtend(Tb, qb_near, Ta.node[qa_reach]['config']) 
-                if numpy.array_equal(Ta.node[qa_reach]['config'], Tb.node[qb_reach]['config']):
+                qb_near = self.nearestNeighbor(Tb, Ta.config(qa_reach))
+                (Tb, qb_reach) = self.constrainedExtend(Tb, qb_near, Ta.config(qa_reach))
+                connected = numpy.array_equal(Ta.config(qa_reach), Tb.config(qb_reach))
+                if connected and self.acceptConnection(Ta, qa_reach, Tb, qb_reach):
                     P = self.extractPath(Ta, qa_reach, Tb, qb_reach)
-                    return (self.shortenPath(P), Ta, Tb)
+                    return (P, Ta, Tb)
                 else:
                     # Swap the two trees
-                    Ttemp = Ta.copy()
-                    Ta = Tb.copy()
-                    Tb = Ttemp.copy()
+                    (Ta, Tb) = (Tb, Ta)
         return (None, Ta, Tb) # No Path found
 
+    def timeRemaining(self):
+        '''Time left until the deadline, or else until TOTAL_TIME has passed
+        since planning started'''
+        if self.deadline is not None:
+            return self.deadline - time.time()
+        return self.TOTAL_TIME - (time.time() - self.tstart)
+
+    def timedOut(self):
+        '''True if planning should stop: out of time or cancelled'''
+        return cancelled(self.cancel_token) or self.timeRemaining() <= 0
+
+    def stopReason(self, path):
+        '''Status of a finished plan, for the statistics'''
+        if path is not None:
+            return 'success'
+        return 'cancelled' if cancelled(self.cancel_token) else 'timeout'
+
+    def acceptConnection(self, Ta, qa_reach, Tb, qb_reach):
+        '''Called when the two trees meet at qa_reach and qb_reach. Every
+        edge was validated as it was added, so the connection is accepted
+        @return True if the path through the connection is valid'''
+        return True
+
     def getGoalAndStartTree(self, Ta, Tb):
         '''Return the three with the name goal'''
-        if Ta.graph['name'] == 'goal':
+        if Ta.tree_type is TreeType.GOAL:
             return (Ta, Tb)
-        elif Tb.graph['name'] == 'goal':
+        elif Tb.tree_type is TreeType.GOAL:
             return (Tb, Ta)
         else:
             return ValueError('Neither trees are goal trees!')
@@ -187,41 +320,59 @@ class BiRRTPlanner(object):
     def addRootConfiguration(self, T):
         '''Add goal configurations if the goal is not a single configuration. 
         We sample the end effector set and compute IK, only adding it if
-        it satifies the relevant constraints
+        it satifies the relevant constraints. If goals are sampled in the
+        background, take a ready one instead (only waiting if the tree has
+        no goal yet)
         @param T tree to add to
         @param T tree with new goal node'''
         if self.goal_type is GoalType.JOINT:
             raise TypeError("Cant add root configuration for non tsr-goal")
 
-        searching = True
-        while searching and (time.time() - self.tstart) < self.TOTAL_TIME:
-            # Sample a TSR and then sample an EE pose from that TSR
-            pose = util.SampleTSRForPose(self.goal)
-           
-            # Transform by grasp if needed
-            if self.goal_type is GoalType.TSR_TOOL:
-                ee_pose = numpy.dot(pose, self.grasp)
-            else:
-                ee_pose = pose
-
-            # If there is an ee constraint, check it
-            if self.evaluateConstraints(ConstraintType.GOAL_EE, pose=ee_pose):
-                config = self.manip.ComputeIK(ee_pose)
-                if config is not None:
-                    # if there is a joint constraint, check it
-                    if self.evaluateConstraints(ConstraintType.GOAL_JOINT, config=config, pose=ee_pose):
-                        searching = False
-
-        # Timed out, no root to be added
-        if searching:
+        config = None
+        if self.goal_sampler is not None:
+            # Wait in short slices, so the planning loop can notice a cancellation
+            timeout = None if len(T) > 1 else min(self.timeRemaining(), 0.1)
+            config = self.goal_sampler.pop(timeout=timeout)
+        else:
+            while config is None and not self.timedOut():
+                config = self.sampleGoalConfiguration()
+
+        # Timed out or nothing ready, no root to be added
+        if config is None:
             return T
 
-        # Found goal configuration, add it to the tree
-        name = self.getNextIdx(T)
-        T.add_node(name, config=config)
-        T.add_edge(name, '0g')
+        # Found goal configuration, add it to the tree below the dummy root
+        T.add_node(config, parent=ROOT)
         return T
 
+    def sampleGoalConfiguration(self):
+        '''Single attempt at sampling a goal configuration. Sample a TSR,
+        then an EE pose from that TSR and compute IK for it
+        @return Collision free configuration satisfying the goal constraints,
+                or None if the attempt failed'''
+        pose = util.SampleTSRForPose(self.goal, self.rng, self.np_rng)
+
+        # Transform by grasp if needed
+        if self.goal_type is GoalType.TSR_TOOL:
+            ee_pose = numpy.dot(pose, self.grasp)
+        else:
+            ee_pose = pose
+
+        # If there is an ee constraint, check it
+        if not self.evaluateConstraints(ConstraintType.GOAL_EE, pose=ee_pose):
+            return None
+        self.stats.count('ik_attempts')
+        with self.stats.timer('ik'):
+            config = self.manip.ComputeIK(ee_pose)
+        if config is None:
+            return None
+        # if there is a joint constraint, check it
+        if not self.evaluateConstraints(ConstraintType.GOAL_JOINT, config=config, pose=ee_pose):
+            return None
+        if not self.isCollisionFree(config):
+            return None
+        return config
+
     def randomConfig(self):
         '''Sample a random configuration within the reachable c-space.
         Random values between joint values
@@ -229,61 +380,87 @@ class BiRRTPlanner(object):
         (lower, upper) = self.manip.GetJointLimits()
         joint_values = numpy.zeros(len(lower))
         for i in xrange(len(lower)):
-            joint_values[i] = random.uniform(lower[i], upper[i])
+            joint_values[i] = self.rng.uniform(lower[i], upper[i])
         return joint_values
 
     def nearestNeighbor(self, T, q_rand):
         '''Find nearest neighbor of q_rand in T using euclidean distance in
-        joint space'''
-        nodes = list(T.nodes())
-        tree_dists = [T.node[n]['config'] for n in nodes]
-        dists = spatial.distance.cdist(tree_dists, [q_rand], metric='euclidean')
-        closest_q = nodes[numpy.argmin(dists)]
-        return closest_q
+        joint space (wrapping circular joints)
+        @param T tree to search
+        @param q_rand Configuration to find the nearest node to
+        @return Index of the closest node in T'''
+        with self.stats.timer('nn'):
+            return T.nearest(q_rand)
 
     def constrainedExtend(self, T, q_near, q_target):
         '''Starting from q_near, aim towards q_target as far as you can
         @param T tree to be extending from
         @param q_near Node within T to start from 
-        @param q_target Config of the target to grow towards'''
+        @param q_target Config of the target to grow towards
+        @return (T, idx) tree and index of the node reached'''
+        # Distances and directions are taken in the metric of the tree's
+        # nearest neighbor index, so that circular joints are wrapped
         qs = q_near
         qs_old = q_near
         while True:
-            if numpy.array_equal(q_target, T.node[qs]['config']):
+            if numpy.array_equal(q_target, T.config(qs)):
                 return (T, qs) # Reached target
-            elif numpy.linalg.norm(numpy.subtract(q_target, T.node[qs]['config'])) > numpy.linalg.norm(numpy.subtract(T.node[qs_old]['config'], q_target)):
+            elif T.distance(T.config(qs), q_target) > T.distance(T.config(qs_old), q_target):
                 return (T, qs_old) # Moved further away
 
             qs_old = qs
-            dist = numpy.linalg.norm(numpy.subtract(q_target, T.node[qs]['config']))
-            qs_config_proposed = T.node[qs]['config'] + min(self.QSTEP, dist)*(numpy.subtract(q_target, T.node[qs]['config']) / dist)
-            qs_config = self.approveNewNode(qs_config_proposed, T.node[qs]['config'])
+            diff = T.difference(T.config(qs), q_target)
+            dist = T.distance(T.config(qs), q_target)
+            qs_config_proposed = T.config(qs) + min(self.QSTEP, dist)*(diff / dist)
+            qs_config = self.approveNewNode(qs_config_proposed, T.config(qs))
             if qs_config is not None:
-                qs = self.getNextIdx(T)
-                T.add_node(qs, config=qs_config)
-                T.add_edge(qs_old, qs)
+                qs = T.add_node(qs_config, parent=qs_old)
             else:
                 return (T, qs_old)
 
-    def approveNewNode(self, qs_proposed, qs_parent):
+    def approveNewNode(self, qs_proposed, qs_parent, ee_pose=None):
         '''We will only approve the new node on several conditions. We
         constrain it to be within joint limits. We reject if its in 
         collision or if it violents any path wide constraints
         @param qs_proposed joint position of proposed node
         @param qs_parent joint positon of parent node
+        @param ee_pose (optional) precomputed end effector transform
+               of the clamped proposed node
         @param qs_config joint configuration is approved,
                 otherwise None'''
         qs_config = self.clampJointLimits(qs_proposed)
         collision_free = self.checkEdgeCollision(qs_config, qs_parent)
+        if not collision_free:
+            return None
 
-        ee_pose = self.manip.ComputeFK(qs_config)
+        # The end effector pose is only needed by path constraints
+        if not self.hasConstraints(ConstraintType.PATH_EE, ConstraintType.PATH_JOINT):
+            return qs_config
+        if ee_pose is None:
+            ee_pose = self.computeFK([qs_config])[0]
         ee_constraint = self.evaluateConstraints(ConstraintType.PATH_EE, pose=ee_pose)
         joint_constraint = self.evaluateConstraints(ConstraintType.PATH_JOINT, config=qs_config, pose=ee_pose)
-        if collision_free and ee_constraint and joint_constraint:
+        if ee_constraint and joint_constraint:
             return qs_config
         else:
             return None
 
+    def hasConstraints(self, *constraintTypes):
+        '''Check if any constraint is of one of the given types
+        @param constraintTypes types to look for
+        @return True if there is such a constraint'''
+        if self.constraints is None:
+            return False
+        return any(c[1] in constraintTypes for c in self.constraints)
+
+    def computeFK(self, qs):
+        '''End effector transforms of a batch of configurations
+        @param qs NxM array of joint configurations
+        @return Nx4x4 end effector transforms'''
+        self.stats.count('fk_configs', len(qs))
+        with self.stats.timer('fk'):
+            return util.ComputeFKMany(self.manip, qs)
+
     def clampJointLimits(self, qs):
         '''Given a proposed next joint space location, check that it is within
         joint limits. If it is not, clamp it to the nearest joint limit
@@ -294,68 +471,93 @@ class BiRRTPlanner(object):
         qs_new = [max(lower[i], min(qs[i], upper[i])) for i in xrange(len(lower))]
         return qs_new
 
+    def createEdgeValidator(self):
+        '''Edge validator for the current manipulator and obstacles. The
+        resolution is in joint space unless CARTESIAN_RESOLUTION is set'''
+        if self.CARTESIAN_RESOLUTION is None:
+            return EdgeValidator(self.isCollisionFree, self.CHECK_RESOLUTION, many_fn=self.areCollisionFree)
+        return EdgeValidator(self.isCollisionFree, self.CARTESIAN_RESOLUTION,
+                             points_fn=self.manip.ComputeLinkPositions, many_fn=self.areCollisionFree)
+
+    def isCollisionFree(self, q):
+        '''Check a single configuration against the planning obstacles
+        @param q Joint configuration
+        @return True if collision free'''
+        self.stats.count('collision_checks')
+        with self.stats.timer('collision'):
+            return self.manip.IsCollisionFree(q, obstacles=self.obstacles)
+
+    def areCollisionFree(self, qs, early_exit=False):
+        '''Check a batch of configurations against the planning obstacles
+        @param qs MxN array of joint configurations
+        @param early_exit If True, stop at the first configuration in collision
+        @return Boolean array, True where collision free'''
+        self.stats.count('collision_batches')
+        with self.stats.timer('collision'):
+            return self.manip.IsCollisionFreeMany(qs, obstacles=self.obstacles, early_exit=early_exit)
+
     def checkEdgeCollision(self, q, q_parent):
         '''Check if path from q_first to q_second is collision free
         @param q Joint configuration
         @return collisionFree (boolean) True if collision free''' 
         # Reject if end point is not collision free
-        if not self.manip.IsCollisionFree(q, obstacles=self.obstacles):
+        if not self.isCollisionFree(q):
             return False
-        cdist = util.cspaceLength([q_parent, q])
-        count = int(cdist / 0.025) # Check every 0.025 distance (a little arbitrary)
-
-        # linearly interpolate between that at some step size and check all those points
-        interp = [numpy.linspace(q_parent[i], q[i], count+1).tolist() for i in xrange(len(q))]
-        middle_qs = numpy.transpose(interp)[1:-1] # Remove given points
-        return all((self.manip.IsCollisionFree(m, obstacles=self.obstacles) for m in middle_qs)) 
+        # Check the interpolated points in bisection order, stopping at the first collision
+        self.stats.count('edge_checks')
+        return self.edge_validator.isValid(q_parent, q)
 
     def extractPath(self, Ta, qa_reach, Tb, qb_reach):
         '''We have paths from 0 to each reach where the reaches are equal,
         therefore we connect the two trees to make one path
         @param Ta first tree
-        @param qa_reach end point on first tree (node name)
+        @param qa_reach end point on first tree (node index)
         @param Tb second tree
-        @param qb_reach end point on second tree (node name)
+        @param qb_reach end point on second tree (node index)
         @return path Array of joint values representing the path'''
-        a_pts = nx.shortest_path(Ta, source='0'+Ta.graph['name'][0], target=qa_reach)
-        a_distance = [Ta.node[x]['config'] for x in a_pts]
-        b_pts = nx.shortest_path(Tb, source='0'+Tb.graph['name'][0], target=qb_reach)
-        b_distance = [Tb.node[x]['config'] for x in b_pts] 
+        a_distance = Ta.configs[Ta.path_to_root(qa_reach)]
+        b_distance = Tb.configs[Tb.path_to_root(qb_reach)]
 
-        if Ta.graph['name'] == 'start':
-            path = a_distance + b_distance[::-1]
+        if Ta.tree_type is TreeType.START:
+            path = numpy.vstack((a_distance, b_distance[::-1]))
         else:
-            path = b_distance + a_distance[::-1]
+            path = numpy.vstack((b_distance, a_distance[::-1]))
 
         # If using goal tsr, remove dummy node
         if self.goal_type is not GoalType.JOINT: 
             path = path[0:len(path)-1]
-        return numpy.array(path)
+        return path
 
     def shortenPath(self, P):
-        '''Given time remaining, we randomly sample to see if we can shorten
-        the path. For a random subsection of the path, we see if we can
-        replace it with a shorter path
+        '''Within SHORTEN_TIME (and the time remaining when planning
+        anytime), try to replace subsections of the path with shorter
+        straight segments (see Shortcutter for the strategies)
         @param P current path represnted as array of joint poses
         @param P new path (same representation) that is equal lenght or less'''
-        shortenStart = time.time()
-        #while ((time.time() - self.tstart) < self.TOTAL_TIME) and ((time.time() - shortenStart) < shortenTime):
-        while (time.time() - shortenStart) < self.SHORTEN_TIME:
-            if len(P) < 3: return P # Too few waypoints to shortcut
-            Tshortcut = nx.DiGraph(name='postprocessing')
-            i = random.randint(0, len(P)-2)
-            j = random.randint(i, len(P)-1)
-            Tshortcut.add_node('0p', config=P[i])
-            (newT, qreach) = self.constrainedExtend(Tshortcut, '0p', P[j])
-            if numpy.array_equal(newT.node[qreach]['config'], P[j]):
-                old_length = util.cspaceLength(P[i:j+1])
-                newNodePath = nx.shortest_path(newT, '0p', qreach)
-                newJointPath = [newT.node[x]['config'] for x in newNodePath]
-                new_length = util.cspaceLength(newJointPath)
-                if new_length < old_length:
-                    P = numpy.vstack((P[0:i], newJointPath, P[j+1:]))
-        return P
-
-    def getNextIdx(self, T):
-        '''Given tree, search node values and give the next node value'''
-        return str(max([int(x[:-1]) for x in T.nodes()])+1) + T.graph['name'][0] 
+        max_time = self.SHORTEN_TIME if self.deadline is None else min(self.SHORTEN_TIME, self.timeRemaining())
+        shortcutter = Shortcutter(self.shortcutSegment, self.SHORTCUT, max_time=max_time,
+                                  cancel_token=self.cancel_token, rng=self.rng)
+        with self.stats.timer('smooth'):
+            return shortcutter.shorten(P)
+
+    def shortcutSegment(self, q1, q2):
+        '''Straight segment from q1 to q2, taken in steps of at most QSTEP
+        that are approved like a tree extension
+        @param q1 Joint configuration to start from
+        @param q2 Joint configuration to end at
+        @return Array of configurations from q1 to q2, None if invalid'''
+        dist = numpy.linalg.norm(numpy.subtract(q2, q1))
+        num_steps = max(1, int(numpy.ceil(dist / self.QSTEP)))
+        steps = [self.clampJointLimits(numpy.add(q1, (float(k) / num_steps)*numpy.subtract(q2, q1)))
+                 for k in xrange(1, num_steps+1)]
+        # Forward kinematics of all steps at once, if path constraints need it
+        ee_poses = [None]*num_steps
+        if self.hasConstraints(ConstraintType.PATH_EE, ConstraintType.PATH_JOINT):
+            ee_poses = self.computeFK(steps)
+        segment = [q1]
+        for q, ee_pose in zip(steps, ee_poses):
+            q = self.approveNewNode(q, segment[-1], ee_pose=ee_pose)
+            if q is None:
+                return None
+            segment.append(q)
+        return numpy.vstack(segment) 
@@ -0,0 +1,82 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Shared validation of straight joint-space edges'''
+
+import numpy
+from pb_robot.crg_planners.utils import bisect_order
+
+class EdgeValidator(object):
+    '''Check that the straight joint-space segment between two configurations
+    is valid. The interpolated states are checked in recursive bisection
+    (van der Corput) order with early exit. A collision anywhere on the edge
+    is then usually found after a few checks instead of a full sweep'''
+    def __init__(self, is_valid_fn, resolution, points_fn=None, min_steps=0, many_fn=None, extend_fn=None):
+        '''Set up the validator
+        @param is_valid_fn Function q -> True if configuration q is valid
+        @param resolution Maximum spacing between checked states. This is a
+               joint space (euclidean) distance if points_fn is None and
+               otherwise the largest Cartesian displacement of any link
+        @param points_fn Optional function q -> Mx3 array of link positions,
+               used to measure the Cartesian displacement of an edge
+        @param min_steps Minimum number of interpolation steps
+        @param many_fn Optional batch version of is_valid_fn, function
+               (qs, early_exit) -> boolean array, True where valid
+        @param extend_fn Optional function (q1, q2) -> configurations after
+               q1 up to and including q2 (e.g. pb_robot.planning.get_extend_fn),
+               used instead of interpolating at the resolution'''
+        self.is_valid_fn = is_valid_fn
+        self.resolution = resolution
+        self.points_fn = points_fn
+        self.min_steps = min_steps
+        self.many_fn = many_fn
+        self.extend_fn = extend_fn
+
+    def edgeLength(self, q1, q2):
+        '''Length of an edge in the units of the resolution. For Cartesian
+        resolutions this is the largest displacement of any link between
+        the two end configurations'''
+        if self.points_fn is None:
+            return numpy.linalg.norm(numpy.subtract(q2, q1))
+        displacement = numpy.subtract(self.points_fn(q2), self.points_fn(q1))
+        return numpy.max(numpy.linalg.norm(displacement, axis=1))
+
+    def interpolate(self, q1, q2):
+        '''Interpolate between q1 and q2 (exclusive) at the resolution
+        @return Kxn array of intermediate configurations in sweep order'''
+        if self.extend_fn is not None:
+            states = list(self.extend_fn(q1, q2))[:-1]
+            return numpy.array(states, dtype=float).reshape(len(states), len(q1))
+        q1 = numpy.asarray(q1, dtype=float)
+        q2 = numpy.asarray(q2, dtype=float)
+        count = max(self.min_steps, int(self.edgeLength(q1, q2) / self.resolution))
+        if count < 2:
+            return numpy.empty((0, len(q1)))
+        fractions = numpy.arange(1, count) / float(count)
+        return q1 + fractions[:, None]*(q2 - q1)
+
+    def orderedStates(self, q1, q2):
+        '''Intermediate configurations between q1 and q2 in bisection order'''
+        states = self.interpolate(q1, q2)
+        return states[bisect_order(len(states))]
+
+    def isValid(self, q1, q2):
+        '''Check the intermediate configurations of the edge from q1 to q2.
+        The end configurations themselves are not checked
+        @return True if all intermediate configurations are valid'''
+        return self.areValid(self.orderedStates(q1, q2))
+
+    def validStates(self, q1, q2):
+        '''Check the edge from q1 to q2 like isValid
+        @return Kxn array of intermediate configurations in sweep order,
+                None if any of them is invalid'''
+        states = self.interpolate(q1, q2)
+        if not self.areValid(states[bisect_order(len(states))]):
+            return None
+        return states
+
+    def areValid(self, states):
+        '''Check configurations in the given order, with early exit'''
+        if self.many_fn is not None:
+            return (len(states) == 0) or self.many_fn(states, early_exit=True).all()
+        return all(self.is_valid_fn(q) for q in states)
@@ -0,0 +1,80 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Produce goal configurations for TSR goals in a background process'''
+
+import multiprocessing
+import random
+import numpy
+import pb_robot
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+class GoalSampler(object):
+    '''Fill a bounded queue of goal configurations ahead of time. The
+    sampling runs in a forked worker process. With a DIRECT physics
+    connection the fork gets a private copy of the simulation, so it can set
+    joints, compute IK and collision check without touching the planning
+    process. The worker blocks once the queue is full'''
+    def __init__(self, sample_fn, buffer_size=8, rngs=(), seed=None):
+        '''Set up the sampler, call start() to launch the worker
+        @param sample_fn Function () -> configuration or None. Each call is
+               one attempt at sampling a valid goal configuration
+        @param buffer_size Number of goal configurations to keep ready
+        @param rngs Random generators (random.Random or numpy RandomState)
+               sample_fn draws from, reseeded in the worker
+        @param seed Seed of the worker, if None a fresh seed is used. The
+               sequence of goals is then reproducible, which of them are
+               popped still depends on timing'''
+        self.sample_fn = sample_fn
+        self.rngs = rngs
+        self.seed = seed
+        self.queue = multiprocessing.Queue(maxsize=buffer_size)
+        self.process = None
+
+    @staticmethod
+    def available():
+        '''True if the current physics connection can be forked. Daemonic
+        processes (e.g. ParallelPlanner workers) cannot start children'''
+        return pb_robot.utils.is_forkable() and not multiprocessing.current_process().daemon
+
+    def start(self):
+        '''Fork the worker process'''
+        self.process = multiprocessing.Process(target=self.run)
+        self.process.daemon = True
+        self.process.start()
+
+    def run(self):
+        '''Worker loop. The random state is copied by the fork, so reseed
+        to not replay the samples of the planning process'''
+        random.seed(self.seed)
+        numpy.random.seed(self.seed)
+        for rng in self.rngs:
+            rng.seed(self.seed)
+        while True:
+            config = self.sample_fn()
+            if config is not None:
+                self.queue.put(numpy.array(config))
+
+    def pop(self, timeout=None):
+        '''Take a ready goal configuration from the queue
+        @param timeout Seconds to wait for one. If None, do not block
+        @return Configuration or None if none is ready'''
+        try:
+            if timeout is None:
+                return self.queue.get_nowait()
+            return self.queue.get(timeout=max(timeout, 0))
+        except Empty:
+            return None
+
+    def stop(self):
+        '''Terminate the worker and drop the remaining goals'''
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+        self.queue.cancel_join_thread()
+        self.queue.close()
@@ -0,0 +1,107 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''BiRRT that postpones edge collision checking until a path is found'''
+
+import numpy
+from birrt import BiRRTPlanner
+from tree import ROOT
+from plannerTypes import GoalType, TreeType
+
+class LazyBiRRTPlanner(BiRRTPlanner):
+    '''Lazy variant of the BiRRT. While growing the trees only the new
+    vertices are checked (collision and path constraints). Once the trees
+    connect, the edges along the candidate path are validated. An invalid
+    edge is removed: we try to re-attach the orphaned subtree to its nearest
+    remaining node and otherwise prune it, and the search continues. Most
+    edges never end up on a solution path, so most are never checked'''
+    def __init__(self):
+        super(LazyBiRRTPlanner, self).__init__()
+        self.lazy = False
+        self.checked = None # Per tree, the nodes whose parent edge is validated
+
+    def plan(self, Ta, Tb):
+        '''Grow the trees lazily. Path shortening validates edges as it
+        adds them'''
+        self.lazy = True
+        self.checked = {Ta.tree_type: set(), Tb.tree_type: set()}
+        try:
+            return super(LazyBiRRTPlanner, self).plan(Ta, Tb)
+        finally:
+            self.lazy = False
+
+    def shortenPath(self, P):
+        '''Shortcuts are not part of the trees, so check them eagerly'''
+        self.lazy = False
+        return super(LazyBiRRTPlanner, self).shortenPath(P)
+
+    def checkEdgeCollision(self, q, q_parent):
+        '''While growing the trees, only check the new vertex
+        @param q Joint configuration
+        @param q_parent Joint configuration of the parent node
+        @return collisionFree (boolean) True if collision free'''
+        if not self.lazy:
+            return super(LazyBiRRTPlanner, self).checkEdgeCollision(q, q_parent)
+        return self.isCollisionFree(q)
+
+    def acceptConnection(self, Ta, qa_reach, Tb, qb_reach):
+        '''Validate the edges on the path through the connection. If an edge
+        is invalid, the trees are repaired and the connection is rejected
+        @return True if all edges on the path are collision free'''
+        return self.validatePath(Ta, qa_reach) and self.validatePath(Tb, qb_reach)
+
+    def isVirtualEdge(self, T, idx):
+        '''Goal configurations sampled from a TSR hang off a dummy root.
+        Those edges do not correspond to any motion'''
+        return (T.tree_type is TreeType.GOAL) and (self.goal_type is not GoalType.JOINT) \
+            and (T.parents[idx] == ROOT)
+
+    def validatePath(self, T, idx):
+        '''Check the unchecked edges from node idx to the root of T
+        @param T tree to validate
+        @param idx Node to start from
+        @return True if all edges were valid'''
+        checked = self.checked[T.tree_type]
+        for node in T.path_to_root(idx):
+            if (T.parents[node] == -1) or (node in checked) or self.isVirtualEdge(T, node):
+                continue
+            self.stats.count('edge_checks')
+            if self.edge_validator.isValid(T.config(T.parents[node]), T.config(node)):
+                checked.add(node)
+            else:
+                self.repairEdge(T, node)
+                return False
+        return True
+
+    def repairEdge(self, T, idx):
+        '''Remove the invalid edge from node idx to its parent. The subtree
+        below idx is re-attached to its nearest remaining node if that edge
+        is approved (see approveEdge), otherwise it is pruned from the tree
+        @param T tree to repair
+        @param idx Node whose parent edge is invalid'''
+        subtree = T.subtree(idx)
+        T.removeNodes(subtree)
+        self.checked[T.tree_type].discard(idx)
+        self.stats.count('repairs')
+        new_parent = self.nearestNeighbor(T, T.config(idx))
+        if T.active[new_parent] and numpy.isfinite(T.config(new_parent)).all() and \
+                self.approveEdge(T.config(new_parent), T.config(idx)):
+            T.parents[idx] = new_parent
+            T.restoreNodes(subtree)
+            self.checked[T.tree_type].add(idx)
+
+    def approveEdge(self, q_parent, q):
+        '''Approve an edge that is added to a tree outside of an extension,
+        like a new node in constrainedExtend: at most QSTEP long, collision
+        free (checked eagerly) and satisfying the path constraints
+        @param q_parent Joint configuration of the new parent
+        @param q Joint configuration of the child
+        @return True if the edge is approved'''
+        if numpy.linalg.norm(numpy.subtract(q, q_parent)) > self.QSTEP:
+            return False
+        lazy = self.lazy
+        self.lazy = False
+        try:
+            return self.approveNewNode(q, q_parent) is not None
+        finally:
+            self.lazy = lazy
@@ -0,0 +1,161 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Run a portfolio of planners concurrently in forked worker processes'''
+
+import multiprocessing
+import random
+import time
+import warnings
+import numpy
+import pb_robot
+import util
+from birrt import BiRRTPlanner
+from lazy_birrt import LazyBiRRTPlanner
+from plannerTypes import GoalType
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+class ParallelPlanner(object):
+    '''Portfolio planner. The same query is solved by several workers, each
+    a forked process with a private copy of the (DIRECT) physics client, a
+    different random seed and possibly a different planner. Sampling based
+    planners have a long tail of planning times, the fastest of K
+    independent runs cuts that tail. Either the first path found is
+    returned, or the workers plan anytime (see BiRRTPlanner.PlanAnytime)
+    until TOTAL_TIME and the shortest path any of them found is returned.
+    The remaining workers are terminated'''
+    def __init__(self, planners=None, num_workers=None):
+        '''Set up the portfolio
+        @param planners List of planners with the BiRRTPlanner interface.
+               Worker i runs planners[i % len(planners)]
+        @param num_workers Number of worker processes, defaults to the
+               number of cores but at most MAX_WORKERS'''
+        ## Constants
+        self.TOTAL_TIME = 15.0
+        self.FIRST_PATH = True # Otherwise the shortest path within TOTAL_TIME
+        self.MAX_WORKERS = 4 # Default cap, every worker is a full process
+
+        if planners is None:
+            planners = [BiRRTPlanner(), LazyBiRRTPlanner()]
+        if num_workers is None:
+            num_workers = min(multiprocessing.cpu_count(), self.MAX_WORKERS)
+        self.planners = planners
+        self.num_workers = num_workers
+
+    def PlanToConfiguration(self, manip, start, goal_config, **kw_args):
+        '''Plan from one joint location (start) to another (goal_config),
+        see BiRRTPlanner.PlanToConfiguration'''
+        return self.solve('PlanToConfiguration', manip, start, goal_config, **kw_args)
+
+    def PlanToEndEffectorPose(self, manip, start, goal_pose, **kw_args):
+        '''Plan from one joint location (start) to an end effector pose
+        (goal_pose), see BiRRTPlanner.PlanToEndEffectorPose'''
+        return self.solve('PlanToEndEffectorPose', manip, start, goal_pose, **kw_args)
+
+    def PlanToEndEffectorPoses(self, manip, start, goal_poses, **kw_args):
+        '''Plan from one joint location (start) to any of a set of end
+        effector poses, see BiRRTPlanner.PlanToEndEffectorPoses'''
+        return self.solve('PlanToEndEffectorPoses', manip, start, goal_poses, **kw_args)
+
+    def PlanToEndEffectorTSR(self, manip, start, goal_tsr, **kw_args):
+        '''Plan from one joint location (start) to any pose defined by a TSR
+        on the end effector, see BiRRTPlanner.PlanToEndEffectorTSR'''
+        return self.solve('PlanToEndEffectorTSR', manip, start, goal_tsr, **kw_args)
+
+    def PlanJointMotion(self, body, joints, end_conf, **kwargs):
+        '''Run planning.plan_joint_motion in every worker. It is not an
+        anytime planner, so without FIRST_PATH the shortest of the paths
+        found by the workers is returned
+        @return List of configurations or None if planning failed'''
+        fn = pb_robot.planning.plan_joint_motion
+        return self.run([fn]*self.num_workers, body, joints, end_conf, **kwargs)
+
+    def solve(self, method, manip, start, goal, **kwargs):
+        '''Call the planning method (by name) of each worker's planner. Without
+        FIRST_PATH, the equivalent anytime query is planned until TOTAL_TIME'''
+        planners = [self.planners[i % len(self.planners)] for i in xrange(self.num_workers)]
+        if self.FIRST_PATH:
+            return self.run([getattr(planner, method) for planner in planners], manip, start, goal, **kwargs)
+        (goalLocation, goal_type) = self.anytimeGoal(method, manip, goal)
+        deadline = time.time() + self.TOTAL_TIME
+        return self.run([planner.PlanAnytime for planner in planners], manip, start, goalLocation, goal_type,
+                        deadline, anytime=True, **kwargs)
+
+    @staticmethod
+    def anytimeGoal(method, manip, goal):
+        '''Goal location and type of PlanAnytime for a planning method, as
+        the BiRRTPlanner methods convert them
+        @return (goalLocation, goal_type)'''
+        if method == 'PlanToConfiguration':
+            return (goal, GoalType.JOINT)
+        if method == 'PlanToEndEffectorPose':
+            return ([util.CreateTSRFromPose(manip, goal)], GoalType.TSR_EE)
+        if method == 'PlanToEndEffectorPoses':
+            return ([util.CreateTSRFromPose(manip, pose) for pose in goal], GoalType.TSR_EE)
+        if method == 'PlanToEndEffectorTSR':
+            return (goal, GoalType.TSR_EE)
+        raise ValueError('No anytime version of {}'.format(method))
+
+    def run(self, fns, *args, **kwargs):
+        '''Call fns[i](*args, **kwargs) in worker i and collect the paths.
+        Without a forkable physics client, only the first function is run,
+        in this process
+        @param fns List of planning functions, one per worker
+        @param anytime If True, the functions take a callback that is called
+               with every improved path (see BiRRTPlanner.PlanAnytime)
+        @return path or None if no worker found one in time'''
+        anytime = kwargs.pop('anytime', False)
+        if not pb_robot.utils.is_forkable():
+            warnings.warn('The physics client cannot be forked, planning with a single planner in this process')
+            return fns[0](*args, **kwargs)
+
+        queue = multiprocessing.Queue()
+        seed = random.randint(0, 2**30)
+        workers = []
+        for i, fn in enumerate(fns):
+            worker = multiprocessing.Process(target=self.work, args=(queue, i, seed + i, fn, args, kwargs, anytime))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        deadline = time.time() + self.TOTAL_TIME
+        best = None
+        running = len(workers)
+        try:
+            while running > 0:
+                try:
+                    (_, path, done) = queue.get(timeout=max(deadline - time.time(), 0))
+                except Empty:
+                    break # Out of time
+                running -= done
+                if path is None:
+                    continue
+                if self.FIRST_PATH:
+                    return path
+                if (best is None) or (util.cspaceLength(path) < util.cspaceLength(best)):
+                    best = path
+            return best
+        finally:
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+            queue.cancel_join_thread()
+            queue.close()
+
+    @staticmethod
+    def work(queue, index, seed, fn, args, kwargs, anytime=False):
+        '''Worker process. Report every improved path when planning anytime,
+        then the final path (or None if planning failed) as done'''
+        random.seed(seed)
+        numpy.random.seed(seed)
+        if anytime:
+            kwargs = dict(kwargs, callback=lambda path: queue.put((index, path, False)))
+        path = None
+        try:
+            path = fn(*args, **kwargs)
+        finally:
+            queue.put((index, path, True))
@@ -12,8 +12,17 @@ class GoalType(Enum):
     TSR_EE = 2
     TSR_TOOL = 3
 
+class TreeType(Enum):
+    START = 1
+    GOAL = 2
+
 class ConstraintType(Enum):
     GOAL_JOINT = 1
     GOAL_EE = 2
     PATH_JOINT = 3
     PATH_EE = 4
+
+class ShortcutType(Enum):
+    GREEDY = 1
+    PARTIAL = 2
+    RANDOM = 3
@@ -0,0 +1,134 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Path shortcutting with a shared segment validation cache'''
+
+import random
+import time
+import numpy
+import util
+from pb_robot.crg_planners.anytime import expired
+from plannerTypes import ShortcutType
+
+class Shortcutter(object):
+    '''Shorten a joint-space path by replacing subpaths with straight
+    segments. Every segment is validated at most once per shortcutter: the
+    result (valid or not) is cached on its end configurations and shared by
+    all strategies. Shortcutting stops once the strategy converges instead
+    of always using the full time budget
+      GREEDY  - try the longest spans first, restart after every success
+                and stop after a pass without improvement. Deterministic
+      PARTIAL - shortcut a single random joint over a random span, the
+                other joints follow the original path
+      RANDOM  - random spans, stop after a number of failures in a row'''
+    def __init__(self, segment_fn, strategy=ShortcutType.GREEDY, max_time=1.0, patience=20, tolerance=1e-3,
+                 cancel_token=None, rng=random):
+        '''Set up the shortcutter
+        @param segment_fn Function (q1, q2) -> Kxn array of configurations
+               from q1 to q2 (inclusive) or None if the segment is invalid
+        @param strategy ShortcutType
+        @param max_time Time budget in seconds
+        @param patience Failed attempts in a row before the randomized
+               strategies are considered converged
+        @param tolerance Minimum decrease in path length to accept
+        @param cancel_token Optional CancellationToken to stop early
+        @param rng random.Random of the randomized strategies (default: global)'''
+        self.segment_fn = segment_fn
+        self.strategy = strategy
+        self.max_time = max_time
+        self.patience = patience
+        self.tolerance = tolerance
+        self.cancel_token = cancel_token
+        self.rng = rng
+        self.cache = {}
+
+    def segment(self, q1, q2):
+        '''Validated segment from q1 to q2, computed once per pair'''
+        key = (tuple(q1), tuple(q2))
+        if key not in self.cache:
+            self.cache[key] = self.segment_fn(q1, q2)
+        return self.cache[key]
+
+    def shorten(self, P):
+        '''Shorten the path with the configured strategy
+        @param P Path as an array of joint configurations
+        @return Path of equal or shorter length'''
+        deadline = time.time() + self.max_time
+        P = numpy.asarray(P)
+        if self.strategy is ShortcutType.GREEDY:
+            return self.shortenGreedy(P, deadline)
+        if self.strategy is ShortcutType.PARTIAL:
+            return self.shortenRandom(P, deadline, self.partialShortcut)
+        if self.strategy is ShortcutType.RANDOM:
+            return self.shortenRandom(P, deadline, self.shortcut)
+        raise ValueError(self.strategy)
+
+    def shortenGreedy(self, P, deadline):
+        '''Longest spans first, until a full pass does not improve the path'''
+        improved = True
+        while improved:
+            improved = False
+            for span in xrange(len(P)-1, 1, -1):
+                for i in xrange(len(P)-span):
+                    if expired(deadline, self.cancel_token):
+                        return P
+                    new_P = self.shortcut(P, i, i+span)
+                    if new_P is not None:
+                        (P, improved) = (new_P, True)
+                        break
+                if improved:
+                    break
+        return P
+
+    def shortenRandom(self, P, deadline, shortcut_fn):
+        '''Random spans, until patience attempts in a row have failed'''
+        failures = 0
+        while failures < self.patience and not expired(deadline, self.cancel_token):
+            if len(P) < 3:
+                return P # Too few waypoints to shortcut
+            i = self.rng.randint(0, len(P)-3)
+            j = self.rng.randint(i+2, len(P)-1)
+            new_P = shortcut_fn(P, i, j)
+            if new_P is None:
+                failures += 1
+            else:
+                (P, failures) = (new_P, 0)
+        return P
+
+    def replace(self, P, i, j, subpath):
+        '''Replace P[i:j+1] with subpath if that shortens the path
+        @return New path or None if it is not shorter'''
+        if util.cspaceLength(subpath) < util.cspaceLength(P[i:j+1]) - self.tolerance:
+            return numpy.vstack((P[:i], subpath, P[j+1:]))
+        return None
+
+    def shortcut(self, P, i, j):
+        '''Replace the span from i to j with a straight segment
+        @return New path or None if the shortcut failed'''
+        subpath = self.segment(P[i], P[j])
+        if subpath is None:
+            return None
+        return self.replace(P, i, j, subpath)
+
+    def partialShortcut(self, P, i, j):
+        '''Interpolate a single random joint linearly (by path length) over
+        the span from i to j
+        @return New path or None if the shortcut failed'''
+        original = P[i:j+1]
+        steps = numpy.linalg.norm(numpy.diff(original, axis=0), axis=1)
+        if steps.sum() == 0:
+            return None
+        fractions = numpy.concatenate(([0], numpy.cumsum(steps))) / steps.sum()
+        k = self.rng.randint(0, P.shape[1]-1)
+        modified = original.copy()
+        modified[:, k] = P[i, k] + fractions*(P[j, k] - P[i, k])
+        modified[-1] = P[j]
+        if util.cspaceLength(modified) >= util.cspaceLength(original) - self.tolerance:
+            return None
+        subpath = [modified[:1]]
+        for (q1, q2) in zip(modified, modified[1:]):
+            segment = self.segment(q1, q2)
+            if segment is None:
+                return None
+            subpath.append(segment[1:])
+        return self.replace(P, i, j, numpy.vstack(subpath))
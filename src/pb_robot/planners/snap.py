@@ -3,13 +3,17 @@
 
 '''Snap Planner between two configurations. Straight line in configuration space'''
 
-import numpy
-import util
+from edge import EdgeValidator
+from pb_robot.crg_planners.stats import PlannerStats
 
 class SnapPlanner(object):
     '''Snap Planner - maintaining class structure because may be useful later when all formatting'''
     def __init__(self):
-        self.checkRate = 0.05
+        self.checkRate = 0.05 # Joint space distance between checks
+
+        # Statistics of the last plan, passed to every sink in stats_sinks
+        self.stats = PlannerStats(self.__class__.__name__)
+        self.stats_sinks = []
 
     def PlanToConfiguration(self, manip, start_q, goal_q, obstacles=None):
         '''Plan from one joint location (start) to another (goal_config)
@@ -18,20 +22,26 @@ class SnapPlanner(object):
         @param start_q Joint pose to start from
         @param goal_q Joint pose to plan to
         @return joint trajectory or None if plan failed'''
+        self.stats = PlannerStats(self.__class__.__name__, sinks=self.stats_sinks)
+        if getattr(manip, 'collision_cache', None) is not None:
+            self.stats.track('collision_cache', manip.collision_cache)
+        is_valid_fn = self.stats.wrap(lambda q: manip.IsCollisionFree(q, obstacles=obstacles),
+                                      'collision', 'collision_checks')
 
         # Check if start and goal are collision-free
-        if (not manip.IsCollisionFree(start_q, obstacles=obstacles)) or (not manip.IsCollisionFree(goal_q, obstacles=obstacles)):
+        if (not is_valid_fn(start_q)) or (not is_valid_fn(goal_q)):
+            self.stats.finish('invalid_endpoints')
             return None
 
-        # Check intermediate points for collisions
-        cdist = util.cspaceLength([start_q, goal_q])
-        count = max(1, int(cdist / self.checkRate)) # Check every 0.1 distance (a little arbitrary)
-
-        # linearly interpolate between that at some step size and check all those points
-        interp = [numpy.linspace(start_q[i], goal_q[i], count+1).tolist() for i in xrange(len(start_q))]
-        middle_qs = numpy.transpose(interp)[1:-1] # Remove given points
-        if not all((manip.IsCollisionFree(m, obstacles=obstacles) for m in middle_qs)):
+        # Check intermediate points for collisions, in bisection order
+        many_fn = self.stats.wrap(lambda qs, early_exit=False: manip.IsCollisionFreeMany(
+            qs, obstacles=obstacles, early_exit=early_exit), 'collision', 'collision_batches')
+        validator = EdgeValidator(is_valid_fn, self.checkRate, min_steps=1, many_fn=many_fn)
+        self.stats.count('edge_checks')
+        if not validator.isValid(start_q, goal_q):
+            self.stats.finish('collision')
             return None
 
         # Have collision-free path. For now just return two points
+        self.stats.finish('success')
         return [start_q, goal_q]
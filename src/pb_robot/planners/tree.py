@@ -0,0 +1,136 @@
+#/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Array-backed search tree used by the sampling based planners'''
+
+import numpy
+from scipy import spatial
+
+# Id of the first node added to a tree
+ROOT = 0
+
+class SearchTree(object):
+    '''Tree of joint configurations stored in preallocated numpy buffers.
+    Node ids are integers handed out by a per-tree counter and index into
+    an NxDOF configuration buffer. Each node stores the id of its parent
+    (-1 for a root). The buffers double in size when they fill up, so
+    adding a node is amortized constant time'''
+    def __init__(self, tree_type, dof, capacity=1024, nn=None):
+        '''Create an empty tree
+        @param tree_type TreeType of the tree (i.e. start or goal)
+        @param dof Number of degrees of freedom of each configuration
+        @param capacity Number of nodes to preallocate
+        @param nn Optional empty nearest neighbor index (NearestNeighbors)
+               that is kept in sync with the nodes. If None, nearest
+               neighbor queries fall back on brute force'''
+        self.tree_type = tree_type
+        self.dof = dof
+        self.configs = numpy.empty((capacity, dof))
+        self.parents = numpy.empty(capacity, dtype=int)
+        self.active = numpy.empty(capacity, dtype=bool)
+        self.size = 0
+        self.nn = nn
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return 'SearchTree({}, {} nodes)'.format(self.tree_type, self.size)
+
+    def grow(self):
+        '''Double the capacity of the buffers, keeping the existing nodes'''
+        capacity = 2*len(self.parents)
+        configs = numpy.empty((capacity, self.dof))
+        configs[:self.size] = self.configs[:self.size]
+        parents = numpy.empty(capacity, dtype=int)
+        parents[:self.size] = self.parents[:self.size]
+        active = numpy.empty(capacity, dtype=bool)
+        active[:self.size] = self.active[:self.size]
+        self.configs = configs
+        self.parents = parents
+        self.active = active
+
+    def add_node(self, config, parent=-1):
+        '''Add a configuration to the tree
+        @param config Joint configuration of the new node
+        @param parent Id of the parent node, -1 if the node is a root
+        @return idx Id of the new node'''
+        if self.size == len(self.parents):
+            self.grow()
+        idx = self.size
+        self.configs[idx] = config
+        self.parents[idx] = parent
+        self.active[idx] = True
+        self.size += 1
+        if self.nn is not None:
+            self.nn.add(config)
+        return idx
+
+    def subtree(self, idx):
+        '''Find all active nodes whose path to the root passes through idx
+        @return Array of node ids in the subtree rooted at idx'''
+        inside = numpy.zeros(self.size, dtype=bool)
+        inside[idx] = True
+        while True:
+            grown = inside | (self.active[:self.size] & (self.parents[:self.size] >= 0) &
+                              inside[self.parents[:self.size]])
+            if (grown == inside).all():
+                return numpy.flatnonzero(inside)
+            inside = grown
+
+    def removeNodes(self, ids):
+        '''Deactivate nodes. They keep their ids but are no longer returned
+        by nearest neighbor queries'''
+        for idx in ids:
+            self.active[idx] = False
+            if self.nn is not None:
+                self.nn.remove(idx)
+
+    def restoreNodes(self, ids):
+        '''Reactivate nodes previously removed with removeNodes'''
+        for idx in ids:
+            self.active[idx] = True
+            if self.nn is not None:
+                self.nn.restore(idx)
+
+    def nearest(self, q):
+        '''Find the node closest to configuration q
+        @param q Joint configuration
+        @return Index of the closest node'''
+        if self.nn is not None:
+            return self.nn.nearest(q)
+        dists = spatial.distance.cdist(self.nodes(), [q], metric='euclidean')[:, 0]
+        dists[~self.active[:self.size]] = numpy.inf
+        return numpy.argmin(dists)
+
+    def difference(self, q1, q2):
+        '''Joint difference from q1 to q2 in the metric of the nearest
+        neighbor index (wrapping circular joints), euclidean otherwise'''
+        if self.nn is not None:
+            return self.nn.difference(q1, numpy.atleast_2d(q2))[0]
+        return numpy.subtract(q2, q1)
+
+    def distance(self, q1, q2):
+        '''Distance between q1 and q2 in the metric of the nearest neighbor
+        index, as used by nearest'''
+        if self.nn is not None:
+            return self.nn.distances(q1, numpy.atleast_2d(q2))[0]
+        return numpy.linalg.norm(numpy.subtract(q2, q1))
+
+    def config(self, idx):
+        '''Return the configuration stored at node idx'''
+        return self.configs[idx]
+
+    def nodes(self):
+        '''Return a (view) array of all configurations in the tree'''
+        return self.configs[:self.size]
+
+    def path_to_root(self, idx):
+        '''Walk the parent indices from idx to the root
+        @param idx Node to start from
+        @return List of node indices ordered from the root to idx'''
+        path = []
+        while idx != -1:
+            path.append(idx)
+            idx = self.parents[idx]
+        return path[::-1]
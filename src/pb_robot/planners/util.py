@@ -7,6 +7,7 @@ Various utility functions for constrained tool manipulation
 
 import numpy
 import random
+from contextlib import contextmanager
 from tsr import TSR, TSRChain
 
 def generatePath(path_array):
@@ -32,8 +33,8 @@ def generatePath(path_array):
     # Remove duplicate points
     removeRows = []
     for i in xrange(len(path_array)-1):
-        diff = sum(numpy.subtract(path_array[i], path_array[i+1]))
-        if abs(diff) < 1e-2:
+        diff = numpy.linalg.norm(numpy.subtract(path_array[i], path_array[i+1]))
+        if diff < 1e-2:
             removeRows += [i]
     # Remove all rows after.
     simplifiedPath = numpy.delete(path_array, removeRows, 0)
@@ -57,16 +58,35 @@ def getDirectory():
         objects_path = objects_path[0]
     return objects_path
 
-def SampleTSRForPose(tsr_chain):
+def SampleTSRForPose(tsr_chain, rng=random, np_rng=None):
     '''Shortcutting function for randomly samping a 
     pose from a tsr chain
     @param tsr_chain Chain to sample from
+    @param rng random.Random used to pick the chain (default: global)
+    @param np_rng numpy RandomState the TSR is sampled with (default: global)
     @return ee_pose Pose from tsr chain'''
-    tsr_idx = random.randint(0, len(tsr_chain)-1)
+    tsr_idx = rng.randint(0, len(tsr_chain)-1)
     sampled_tsr = tsr_chain[tsr_idx]
-    ee_pose = sampled_tsr.sample()
+    if np_rng is None:
+        return sampled_tsr.sample()
+    with NumpyRandomState(np_rng):
+        ee_pose = sampled_tsr.sample()
     return ee_pose
 
+@contextmanager
+def NumpyRandomState(np_rng):
+    '''Let code that draws from the global numpy generator (e.g. TSR
+    sampling) draw from np_rng instead. The global state is restored
+    afterwards and np_rng advances as if it had been used directly
+    @param np_rng numpy RandomState'''
+    saved = numpy.random.get_state()
+    numpy.random.set_state(np_rng.get_state())
+    try:
+        yield
+    finally:
+        np_rng.set_state(numpy.random.get_state())
+        numpy.random.set_state(saved)
+
 def CreateTSRFromPose(manip, pose):
     '''Create a TSR that, when sampled, produces one pose. This 
     simply creates a common interface for the planner
@@ -77,6 +97,16 @@ def CreateTSRFromPose(manip, pose):
     tsr_chain = TSRChain(sample_goal=True, TSR=goal_tsr)
     return tsr_chain
 
+def ComputeFKMany(manip, qs):
+    '''End effector transforms of many configurations, batched when the
+    manipulator supports it
+    @param manip Manipulator to use
+    @param qs NxM array of joint configurations
+    @return Nx4x4 end effector transforms'''
+    if hasattr(manip, 'ComputeFKMany'):
+        return manip.ComputeFKMany(qs)
+    return numpy.array([manip.ComputeFK(q) for q in qs])
+
 def cspaceLength(path):
     '''Compute the euclidean distance in joint space of a path by summing along pts
     @param path List of joint configurations 
@@ -2,12 +2,15 @@ import random
 import time
 from itertools import product, combinations
 from collections import namedtuple
-from crg_planners.rrt_connect import birrt, direct_path
+from crg_planners.rrt_connect import birrt
+from crg_planners.nearest import NearestNeighbors
+from planners.edge import EdgeValidator
 
 import numpy as np
 import pybullet as p
 import pb_robot
 import pb_robot.geometry as geometry
+from pb_robot.collisions import is_pair_disabled
 
 PI = np.pi
 CIRCULAR_LIMITS = -PI, PI
@@ -68,6 +71,13 @@ def get_distance_fn(body, joints, weights=None): #, norm=2):
         #return np.linalg.norm(np.multiply(weights * diff), ord=norm)
     return fn
 
+def get_nn_fn(body, joints, weights=None):
+    # Creates empty nearest neighbor indices that agree with get_distance_fn
+    circular_joints = [joint.is_circular() for joint in joints]
+    def fn():
+        return NearestNeighbors(len(joints), weights=weights, circular=circular_joints)
+    return fn
+
 def get_refine_fn(body, joints, num_steps=0):
     difference_fn = get_difference_fn(body, joints)
     num_steps = num_steps + 1
@@ -123,12 +133,7 @@ def waypoints_from_path(path, tolerance=1e-3):
     return waypoints
 
 def get_moving_links(body, joints):
-    moving_links = set()
-    for joint in joints:
-        link = joint.child_link_from_joint()
-        if link not in moving_links:
-            moving_links.update(link.get_link_subtree())
-    return list(moving_links)
+    return body.get_moving_links(joints)
 
 def get_moving_pairs(body, moving_joints):
     """
@@ -136,12 +141,7 @@ def get_moving_pairs(body, moving_joints):
     Do not check all fixed and fixed pairs
     Check all moving pairs with a common
     """
-    moving_links = body.get_moving_links(moving_joints)
-    for link1, link2 in combinations(moving_links, 2):
-        ancestors1 = set(link1.get_joint_ancestors()) & set(moving_joints)
-        ancestors2 = set(link2.get_joint_ancestors()) & set(moving_joints)
-        if ancestors1 != ancestors2:
-            yield link1, link2
+    return pb_robot.collisions.get_moving_pairs(body, moving_joints)
 
 
 def get_self_link_pairs(body, joints, disabled_collisions=set(), only_moving=True):
@@ -152,9 +152,8 @@ def get_self_link_pairs(body, joints, disabled_collisions=set(), only_moving=Tru
         check_link_pairs.extend(get_moving_pairs(body, joints))
     else:
         check_link_pairs.extend(combinations(moving_links, 2))
-    check_link_pairs = list(filter(lambda pair: not pair.are_links_adjacent(), check_link_pairs))
-    check_link_pairs = list(filter(lambda pair: (pair not in disabled_collisions) and
-                                   (pair[::-1] not in disabled_collisions), check_link_pairs))
+    check_link_pairs = list(filter(lambda pair: not body.are_links_adjacent(*pair), check_link_pairs))
+    check_link_pairs = list(filter(lambda pair: not is_pair_disabled(pair, disabled_collisions), check_link_pairs))
     return check_link_pairs
 
 def get_collision_fn(body, joints, obstacles, attachments, self_collisions, disabled_collisions,
@@ -166,8 +165,11 @@ def get_collision_fn(body, joints, obstacles, attachments, self_collisions, disa
     attached_bodies = [attachment.child for attachment in attachments]
     moving_bodies = [(body, moving_links)] + attached_bodies
     #moving_bodies = [body] + [attachment.child for attachment in attachments]
-    check_body_pairs = list(product(moving_bodies, obstacles))  # + list(combinations(moving_bodies, 2))
+    # Only (moving link, obstacle link) pairs with overlapping AABBs are checked
+    broad_phase_fn = pb_robot.collisions.get_broad_phase_fn(moving_bodies, obstacles,
+                                                            kwargs.get('max_distance', MAX_DISTANCE))
     lower_limits, upper_limits = body.get_custom_limits(joints, custom_limits)
+    joint_ids = body.get_joint_ids(joints)
 
     # TODO: maybe prune the link adjacent to the robot
     # TODO: test self collision with the holding
@@ -175,7 +177,7 @@ def get_collision_fn(body, joints, obstacles, attachments, self_collisions, disa
         if not pb_robot.helper.all_between(lower_limits, q, upper_limits):
             #print('Joint limits violated')
             return True
-        body.set_joint_positions(joints, q)
+        body.set_joint_positions_by_id(joint_ids, q)
         for attachment in attachments:
             attachment.assign()
         for link1, link2 in check_link_pairs:
@@ -183,8 +185,8 @@ def get_collision_fn(body, joints, obstacles, attachments, self_collisions, disa
             if pb_robot.collisions.pairwise_link_collision(body, link1, body, link2): #, **kwargs):
                 #print(get_body_name(body), get_link_name(body, link1), get_link_name(body, link2))
                 return True
-        for body1, body2 in check_body_pairs:
-            if pb_robot.collisions.pairwise_collision(body1, body2, **kwargs):
+        for (body1, link1), (body2, link2) in broad_phase_fn():
+            if pb_robot.collisions.pairwise_link_collision(body1, link1, body2, link2, **kwargs):
                 #print(get_body_name(body1), get_body_name(body2))
                 return True
         return False
@@ -205,15 +207,29 @@ def plan_waypoints_joint_motion(body, joints, waypoints, start_conf=None, obstac
         if collision_fn(waypoint):
             #print("Warning: waypoint configuration {}/{} is in collision".format(i, len(waypoints)))
             return None
+    validator = get_edge_validator(extend_fn, collision_fn)
     path = [start_conf]
     for waypoint in waypoints:
         assert len(joints) == len(waypoint)
-        for q in extend_fn(path[-1], waypoint):
-            if collision_fn(q):
-                return None
-            path.append(q)
+        states = validator.validStates(path[-1], waypoint)
+        if states is None:
+            return None
+        path.extend(map(tuple, states))
+        path.append(tuple(waypoint))
     return path
 
+def get_edge_validator(extend_fn, collision_fn):
+    # Checks the configurations of extend_fn between two (valid) configurations in bisection order
+    return EdgeValidator(lambda q: not collision_fn(q), None, extend_fn=extend_fn)
+
+def direct_path(q1, q2, extend_fn, collision_fn):
+    if collision_fn(q1) or collision_fn(q2):
+        return None
+    states = get_edge_validator(extend_fn, collision_fn).validStates(q1, q2)
+    if states is None:
+        return None
+    return [q1] + [tuple(q) for q in states] + [tuple(q2)]
+
 def plan_direct_joint_motion(body, joints, end_conf, **kwargs):
     return plan_waypoints_joint_motion(body, joints, [end_conf], **kwargs)
 
@@ -233,6 +249,7 @@ def plan_joint_motion(body, joints, end_conf, obstacles=[], attachments=[],
     assert len(joints) == len(end_conf)
     sample_fn = get_sample_fn(body, joints, custom_limits=custom_limits)
     distance_fn = get_distance_fn(body, joints, weights=weights)
+    nn_fn = get_nn_fn(body, joints, weights=weights)
     extend_fn = get_extend_fn(body, joints, resolutions=resolutions)
     collision_fn = get_collision_fn(body, joints, obstacles, attachments, self_collisions, disabled_collisions,
                                     custom_limits=custom_limits, max_distance=max_distance)
@@ -241,7 +258,7 @@ def plan_joint_motion(body, joints, end_conf, obstacles=[], attachments=[],
 
     if not check_initial_end(start_conf, end_conf, collision_fn):
         return None
-    return birrt(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, **kwargs)
+    return birrt(start_conf, end_conf, distance_fn, sample_fn, extend_fn, collision_fn, nn_fn=nn_fn, **kwargs)
     #return plan_lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn)
 
 def plan_lazy_prm(start_conf, end_conf, sample_fn, extend_fn, collision_fn, **kwargs):
@@ -402,21 +419,25 @@ def compute_jacobian(robot, link, positions=None):
     return list(zip(*translate)), list(zip(*rotate)) # len(joints) x 3
 
 
+def compute_jacobians(robot, links, confs):
+    # Jacobians of many links at many configurations of the movable joints, in numpy (see KinematicChain)
+    # num confs x num links x 6 x num joints, the linear rows first
+    chain = pb_robot.kinematics.get_kinematic_chain(robot)
+    return chain.get_jacobians(confs, robot.get_movable_joints(), links)
+
+
 def compute_joint_weights(robot, num=100):
     # http://openrave.org/docs/0.6.6/_modules/openravepy/databases/linkstatistics/#LinkStatisticsModel
     start_time = time.time()
     joints = robot.get_movable_joints()
     sample_fn = get_sample_fn(robot, joints)
-    weighted_jacobian = np.zeros(len(joints))
     links = list(robot.links)
     # links = {l for j in joints for l in get_link_descendants(self.robot, j)}
-    masses = [robot.get_mass(link.linkID) for link in links]  # Volume, AABB volume
+    masses = np.array([robot.get_mass(link.linkID) for link in links])  # Volume, AABB volume
     total_mass = sum(masses)
-    for _ in range(num):
-        conf = sample_fn()
-        for mass, link in zip(masses, links):
-            translate, rotate = compute_jacobian(robot, link, conf)
-            weighted_jacobian += np.array([mass * np.linalg.norm(vec) for vec in translate]) / total_mass
+    confs = [sample_fn() for _ in range(num)]
+    translates = compute_jacobians(robot, links, confs)[:, :, :3, :]
+    weighted_jacobian = np.einsum('l,nlj->j', masses, np.linalg.norm(translates, axis=2)) / total_mass
     weighted_jacobian /= num
     print(list(weighted_jacobian))
     print(time.time() - start_time)
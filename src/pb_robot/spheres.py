@@ -0,0 +1,258 @@
+import os
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+import pybullet as p
+import pb_robot
+import pb_robot.geometry as geometry
+import pb_robot.helper as helper
+import pb_robot.meshes as meshes
+from pb_robot.collisions import MAX_DISTANCE, get_moving_links
+from pb_robot.kinematics import get_kinematic_chain
+
+# Sphere approximations of robot links, computed from the collision geometry in the URDF.
+# The engine checks the (solid) convex hull of each collision mesh, so the spheres cover the hull volume:
+# the grid cubes that intersect the hull are clustered and every sphere contains all cubes of its cluster.
+# Covering only the surface would miss obstacles that lie fully inside a link.
+# Spheres are computed in memory on first use. They are only persisted (per URDF content hash, see
+# get_spheres_path) by save_spheres, e.g. with scripts/generate_spheres.py
+
+NUM_SPHERES = 8 # Per link
+MAX_EDGE = 0.03 # Edge of the grid cubes the hull volume is covered with (m)
+PADDING = 0.005 # Added to every radius, covers the engine's collision margin (m)
+CYLINDER_SIDES = 16
+
+SPHERES_FROM_HASH = {}
+
+
+def get_spheres_path(urdf_path):
+    return helper.get_cache_path('spheres_{}.json'.format(helper.hash_file(urdf_path)))
+
+
+def resolve_mesh_path(urdf_path, filename):
+    # package://<package>/<path> is searched for in the directories above the URDF
+    if not filename.startswith('package://'):
+        return os.path.join(os.path.dirname(urdf_path), filename)
+    relative_path = filename[len('package://'):]
+    directory = os.path.dirname(os.path.abspath(urdf_path))
+    while True:
+        path = os.path.join(directory, relative_path)
+        if os.path.exists(path) or (os.path.dirname(directory) == directory):
+            return path
+        directory = os.path.dirname(directory)
+
+
+def tform_from_origin(element):
+    # Transform of an URDF <origin xyz="" rpy=""/> element (may be None)
+    if element is None:
+        return np.eye(4)
+    point = [float(x) for x in element.get('xyz', '0 0 0').split()]
+    euler = [float(x) for x in element.get('rpy', '0 0 0').split()]
+    return geometry.tform_from_pose((point, geometry.quat_from_euler(euler)))
+
+
+def get_geometry_vertices(urdf_path, element):
+    # Vertices of an URDF <geometry> element, whose convex hull is the collision shape, None if not supported
+    if element.find('box') is not None:
+        extents = np.array([float(x) for x in element.find('box').get('size').split()])
+        corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)])
+        return corners * extents / 2.
+    if element.find('cylinder') is not None:
+        radius = float(element.find('cylinder').get('radius')) / np.cos(np.pi / CYLINDER_SIDES) # Circumscribed
+        length = float(element.find('cylinder').get('length'))
+        angles = np.linspace(0, 2*np.pi, CYLINDER_SIDES, endpoint=False)
+        circle = np.column_stack([radius*np.cos(angles), radius*np.sin(angles)])
+        return np.vstack([np.column_stack([circle, z*np.ones(CYLINDER_SIDES)]) for z in (-length/2., length/2.)])
+    if element.find('sphere') is not None:
+        # Not a hull, compute_spheres keeps spheres as they are
+        return None
+    mesh = element.find('mesh')
+    if mesh is None:
+        return None
+    path = resolve_mesh_path(urdf_path, mesh.get('filename'))
+    scale = np.array([float(x) for x in mesh.get('scale', '1 1 1').split()])
+    if path.lower().endswith('.stl') and os.path.exists(path):
+        return meshes.read_stl(path, scale=scale).vertices
+    if path.lower().endswith('.obj') and os.path.exists(path):
+        return scale * np.array(meshes.read_obj(path, decompose=False).vertices)
+    return None
+
+
+def get_hull_cubes(vertices, edge=MAX_EDGE):
+    # Corners (Cx8x3) of the cubes of a grid over the bounding box that intersect the convex hull of the vertices.
+    # A cube is kept if its center is within half its diagonal of every facet plane, a superset of the
+    # intersecting cubes, so the kept cubes cover the whole hull
+    from scipy.spatial import ConvexHull
+    hull = ConvexHull(vertices)
+    lower, upper = vertices.min(axis=0), vertices.max(axis=0)
+    num_cubes = np.maximum(np.ceil((upper - lower) / edge), 1).astype(int)
+    axes = [lower[i] + edge*(np.arange(num_cubes[i]) + 0.5) for i in range(3)]
+    centers = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+    distances = centers.dot(hull.equations[:, :3].T) + hull.equations[:, 3]
+    centers = centers[distances.max(axis=1) <= np.sqrt(3)*edge/2.]
+    offsets = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)]) * edge/2.
+    return centers[:, None, :] + offsets[None, :, :]
+
+
+def cluster_points(points, weights, num_clusters, iterations=20):
+    # Weighted k-means with farthest point initialization (deterministic), returns the cluster of each point
+    num_clusters = min(num_clusters, len(points))
+    centers = [points[np.argmax(weights)]]
+    for _ in range(num_clusters - 1):
+        distances = np.min([np.linalg.norm(points - center, axis=1) for center in centers], axis=0)
+        centers.append(points[np.argmax(distances)])
+    centers = np.array(centers)
+    for _ in range(iterations):
+        labels = np.argmin(np.linalg.norm(points[:, None] - centers[None], axis=2), axis=1)
+        for k in range(num_clusters):
+            if np.any(labels == k):
+                centers[k] = np.average(points[labels == k], axis=0, weights=weights[labels == k])
+    return np.argmin(np.linalg.norm(points[:, None] - centers[None], axis=2), axis=1)
+
+
+def spheres_from_hull(vertices, num_spheres=NUM_SPHERES):
+    # Kx4 spheres (x, y, z, radius) whose union contains the convex hull of the vertices
+    cubes = get_hull_cubes(vertices)
+    centers = cubes.mean(axis=1)
+    labels = cluster_points(centers, np.ones(len(centers)), num_spheres)
+    spheres = []
+    for k in np.unique(labels):
+        vertices = cubes[labels == k].reshape(-1, 3)
+        center = (vertices.min(axis=0) + vertices.max(axis=0)) / 2.
+        radius = np.linalg.norm(vertices - center, axis=1).max()
+        spheres.append(list(center) + [radius + PADDING])
+    return spheres
+
+
+def compute_spheres(urdf_path, num_spheres=NUM_SPHERES):
+    # Spheres of every link (in the link frame) as {'links': {name: [[x, y, z, r], ...]}, 'unsupported': [name, ...]}.
+    # Links with collision geometry that cannot be read (e.g. *.dae meshes) are unsupported
+    root = ElementTree.parse(urdf_path).getroot()
+    spheres = {'links': {}, 'unsupported': [], 'num_spheres': num_spheres, 'padding': PADDING, 'filled': True}
+    for link in root.findall('link'):
+        name = link.get('name')
+        link_spheres = []
+        for collision in link.findall('collision'):
+            tform = tform_from_origin(collision.find('origin'))
+            element = collision.find('geometry')
+            if element.find('sphere') is not None:
+                radius = float(element.find('sphere').get('radius'))
+                link_spheres.append(list(tform[:3, 3]) + [radius + PADDING])
+                continue
+            vertices = get_geometry_vertices(urdf_path, element)
+            if vertices is None:
+                spheres['unsupported'].append(name)
+                break
+            vertices = vertices.dot(tform[:3, :3].T) + tform[:3, 3]
+            link_spheres.extend(spheres_from_hull(vertices, num_spheres))
+        else:
+            spheres['links'][name] = link_spheres
+    return spheres
+
+
+def save_spheres(urdf_path, spheres):
+    path = get_spheres_path(urdf_path)
+    helper.ensure_dir(path)
+    helper.write_json(path, spheres)
+    SPHERES_FROM_HASH[helper.hash_file(urdf_path)] = spheres
+    return path
+
+
+def load_spheres(urdf_path):
+    # Read from the cache if saved there, otherwise computed (without writing to the cache)
+    key = helper.hash_file(urdf_path)
+    if key not in SPHERES_FROM_HASH:
+        path = get_spheres_path(urdf_path)
+        spheres = helper.read_json(path) if os.path.exists(path) else None
+        if (spheres is None) or not spheres.get('filled', False):
+            # Missing, or saved before the spheres covered the hull volume
+            spheres = compute_spheres(urdf_path)
+        SPHERES_FROM_HASH[key] = spheres
+    return SPHERES_FROM_HASH[key]
+
+
+class SphereCollisionChecker(object):
+    """
+    Conservative collision checks of many configurations at once, in numpy.
+    The moving links of the body are covered by spheres (see compute_spheres), placed with batched forward
+    kinematics and tested against primitive obstacles: boxes and spheres exactly, planes as the halfspace
+    behind them, all other shapes (meshes, cylinders, ...) by their AABB.
+    A configuration is certified free if every sphere is more than max_distance from every obstacle.
+    All other configurations are borderline and need an exact check, collisions are never certified.
+    Only obstacles are checked, not self-collisions or grasped objects.
+    """
+
+    def __init__(self, body, joints, obstacles, max_distance=MAX_DISTANCE):
+        urdf_path = pb_robot.acm.get_urdf_path(body)
+        if urdf_path is None:
+            raise ValueError('{} was not loaded from an URDF'.format(body))
+        model = load_spheres(urdf_path)
+        self.body = body
+        self.joints = joints
+        self.obstacles = obstacles
+        self.max_distance = max_distance
+        self.chain = get_kinematic_chain(body)
+        link_indices, spheres = [], []
+        for link in get_moving_links(body, joints):
+            name = link.get_link_name()
+            if name in model['unsupported']:
+                raise ValueError('No spheres for link {} of {}'.format(name, body))
+            for sphere in model['links'].get(name, []):
+                link_indices.append(link.linkID + 1)
+                spheres.append(sphere)
+        spheres = pb_robot.utils.get_model_info(body.id).scale * np.array(spheres).reshape(-1, 4)
+        self.link_indices = np.array(link_indices, dtype=int)
+        self.centers = spheres[:, :3]
+        self.radii = spheres[:, 3]
+
+    def get_sphere_centers(self, qs):
+        # NxSx3 world sphere centers at the configurations
+        frames = self.chain.get_link_transforms(qs, self.joints)[:, self.link_indices]
+        return np.einsum('nsij,sj->nsi', frames[:, :, :3, :3], self.centers) + frames[:, :, :3, 3]
+
+    def get_obstacle_shapes(self):
+        # World boxes (center, rotation, half extents), spheres (center, radius) and planes (point, normal)
+        boxes, spheres, planes = [], [], []
+        for obstacle in self.obstacles:
+            for link in obstacle.all_links:
+                com_pose = obstacle.get_pose() if link.linkID == -1 else link.get_com_pose()
+                for data in pb_robot.utils.get_collision_data(obstacle, link.linkID):
+                    tform = geometry.tform_from_pose(geometry.multiply(com_pose, pb_robot.utils.get_data_pose(data)))
+                    if data.geometry_type == p.GEOM_BOX:
+                        extents = np.array(pb_robot.utils.get_data_extents(data)) / 2.
+                        boxes.append((tform[:3, 3], tform[:3, :3], extents))
+                    elif data.geometry_type == p.GEOM_SPHERE:
+                        spheres.append((tform[:3, 3], pb_robot.utils.get_data_radius(data)))
+                    elif data.geometry_type == p.GEOM_PLANE:
+                        normal = tform[:3, :3].dot(pb_robot.utils.get_data_normal(data))
+                        planes.append((tform[:3, 3], normal / np.linalg.norm(normal)))
+                    else:
+                        lower, upper = pb_robot.aabb.get_aabb(obstacle, link)
+                        lower, upper = np.array(lower), np.array(upper)
+                        boxes.append(((lower + upper) / 2., np.eye(3), (upper - lower) / 2.))
+        return boxes, spheres, planes
+
+    def get_distances(self, qs):
+        '''Lower bounds on the distance between the body and the obstacles
+        @param qs NxM array of configurations of the joints
+        @return Array of N distances (negative if possibly penetrating)'''
+        centers = self.get_sphere_centers(qs)
+        distances = np.full(len(centers), np.inf)
+        if len(self.radii) == 0:
+            return distances
+        boxes, spheres, planes = self.get_obstacle_shapes()
+        for center, rotation, extents in boxes:
+            local = np.abs((centers - center).dot(rotation)) - extents
+            box_distances = np.linalg.norm(np.maximum(local, 0), axis=2) + np.minimum(local.max(axis=2), 0)
+            distances = np.minimum(distances, (box_distances - self.radii).min(axis=1))
+        for center, radius in spheres:
+            sphere_distances = np.linalg.norm(centers - center, axis=2) - radius
+            distances = np.minimum(distances, (sphere_distances - self.radii).min(axis=1))
+        for point, normal in planes:
+            plane_distances = (centers - point).dot(normal)
+            distances = np.minimum(distances, (plane_distances - self.radii).min(axis=1))
+        return distances
+
+    def certify(self, qs):
+        '''@return Boolean array, True where the configuration is certainly
+        collision-free (w.r.t. the obstacles)'''
+        return self.get_distances(qs) > self.max_distance
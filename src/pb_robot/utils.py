@@ -114,13 +114,14 @@ class PoseSaver(Saver):
 class ConfSaver(Saver):
     def __init__(self, body): #, joints):
         self.body = body
-        self.conf = body.get_configuration()
+        self.joint_ids = body.get_joint_ids(body.get_movable_joints())
+        self.conf = body.get_joint_positions_by_id(self.joint_ids)
 
     def apply_mapping(self, mapping):
         self.body = mapping.get(self.body, self.body)
 
     def restore(self):
-        self.body.set_configuration(self.conf)
+        self.body.set_joint_positions_by_id(self.joint_ids, self.conf)
 
     def __repr__(self):
         return '{}({})'.format(self.__class__.__name__, self.body)
@@ -213,6 +214,7 @@ def load_pybullet(filename, fixed_base=False, scale=1., **kwargs):
         else:
             raise ValueError(filename)
     INFO_FROM_BODY[CLIENT, body] = ModelInfo(None, filename, fixed_base, scale)
+    pb_robot.body.unregister_body(body)
     return body
 
 def set_caching(cache):
@@ -454,6 +456,11 @@ def get_connection(client=None):
 def has_gui(client=None):
     return get_connection(get_client(client)) == p.GUI
 
+def is_forkable(client=None):
+    # A forked process gets a private copy of an in-process (DIRECT) physics server,
+    # GUI and shared memory connections do not survive the fork
+    return hasattr(os, 'fork') and (get_connection(get_client(client)) == p.DIRECT)
+
 def get_data_path():
     import pybullet_data
     return pybullet_data.getDataPath()
@@ -502,6 +509,8 @@ def update_state():
 
 def reset_simulation():
     p.resetSimulation(physicsClientId=CLIENT)
+    pb_robot.body.clear_bodies()
+    pb_robot.collisions.clear_collision_filters()
 
 CameraInfo = namedtuple('CameraInfo', ['width', 'height', 'viewMatrix', 'projectionMatrix', 'cameraUp', 'cameraForward',
                                        'horizontal', 'vertical', 'yaw', 'pitch', 'dist', 'target'])
@@ -652,7 +661,8 @@ def restore_bullet(filename):
 # Bodies, Joints, Links
 
 def get_bodies():
-    return [pb_robot.body.Body(p.getBodyUniqueId(i, physicsClientId=CLIENT))
+    # The shared wrappers of all bodies (see pb_robot.body.get_body)
+    return [pb_robot.body.get_body(p.getBodyUniqueId(i, physicsClientId=CLIENT))
             for i in range(p.getNumBodies(physicsClientId=CLIENT))]
 
 def has_body(name):
@@ -663,10 +673,11 @@ def has_body(name):
     return True
 
 def body_from_name(name):
-    for body in get_bodies():
-        if body.get_body_name() == name:
-            return body
-    raise ValueError(name)
+    get_bodies() # Registers bodies that were not created through pb_robot
+    body_ids = pb_robot.body.BODY_IDS_FROM_NAME.get((CLIENT, name))
+    if not body_ids:
+        raise ValueError(name)
+    return pb_robot.body.get_body(min(body_ids))
 
 def dump_world():
     for body in get_bodies():
@@ -812,8 +823,10 @@ def create_shape_array(geoms, poses, colors=None):
 #####################################
 
 def create_body(collision_id=-1, visual_id=-1, mass=STATIC_MASS):
-    return p.createMultiBody(baseMass=mass, baseCollisionShapeIndex=collision_id,
+    body = p.createMultiBody(baseMass=mass, baseCollisionShapeIndex=collision_id,
                              baseVisualShapeIndex=visual_id, physicsClientId=CLIENT)
+    pb_robot.body.unregister_body(body)
+    return body
 
 def create_box(w, l, h, mass=STATIC_MASS, color=(1, 0, 0, 1)):
     collision_id, visual_id = create_shape(get_box_geometry(w, l, h), color=color)
@@ -1003,6 +1016,8 @@ def clone_body(body, links=None, collision=True, visual=True, client=None):
                                  linkJointTypes=joint_types,
                                  linkJointAxis=joint_axes,
                                  physicsClientId=client)
+    if client == CLIENT:
+        pb_robot.body.unregister_body(new_body)
     #set_configuration(new_body, get_joint_positions(body, movable_joints)) # Need to use correct client
     for joint, value in zip(range(len(links)), body.get_joint_positions(links)):
         # TODO: check if movable?
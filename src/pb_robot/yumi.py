@@ -28,15 +28,16 @@ class Yumi(body.Body):
 
 class YumiArm(object):
     def __init__(self, bodyID, joints, handName):
-        self.__robot = body.Body(bodyID)
+        self.__robot = body.get_body(bodyID)
         self.joints = joints #XXX not names, actual joints (change variable name)
+        self.jointsID = [j.jointID for j in self.joints]
         self.hand = self.__robot.link_from_name(handName)
 
     def GetJointValues(self):
-        return self.__robot.get_joint_positions(self.joints)
+        return self.__robot.get_joint_positions_by_id(self.jointsID)
     
     def SetJointValues(self, q):
-        return self.__robot.set_joint_positions(self.joints, q)
+        return self.__robot.set_joint_positions_by_id(self.jointsID, q)
 
     def GetJointLimits(self):
         return (self.__robot.get_min_limits(self.joints), 
@@ -46,11 +47,12 @@ class YumiArm(object):
         return geometry.tform_from_pose(self.hand.get_link_pose())
 
     def ComputeFK(self, q):
-        old_q = self.GetJointValues()
-        self.SetJointValues(q)
-        pose = self.GetEETransform()
-        self.SetJointValues(old_q)
-        return pose 
+        return self.ComputeFKMany([q])[0]
+
+    def ComputeFKMany(self, qs):
+        # Nx4x4 hand transforms, computed in numpy without moving the arm
+        chain = pb_robot.kinematics.get_kinematic_chain(self.__robot)
+        return chain.get_link_transform(qs, self.joints, self.hand)
 
     def ComputeIK(self, pose):
         #pose = geometry.pose_from_tform(transform)